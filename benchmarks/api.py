@@ -0,0 +1,461 @@
+"""
+Throughput, latency percentiles and queries per request of every route of the API.
+Seeds a database (a temporary SQLite file unless --database is given) with users, people, planets
+and favourites, then drives each scenario through the Flask test client (one thread, in process,
+queries counted per request) and/or a real gunicorn server (--concurrency threads over HTTP).
+
+    $ python benchmarks/api.py
+    $ python benchmarks/api.py --mode server --workers 2 --concurrency 16 --requests 500
+    $ python benchmarks/api.py --database postgresql://localhost/bench --reset --people 50000
+
+--save-baseline keeps the query counts in a JSON file, --baseline compares a run against one and
+exits with status 1 on a regression: a route needing more queries than before (the most any of its
+requests needed). benchmarks/baseline.json holds the query counts of the default run:
+
+    $ python benchmarks/api.py --baseline benchmarks/baseline.json
+
+Timings vary too much between runs of the same code to gate on them by default. --timings saves and
+compares them too: every mode runs --runs times (3), the median of the runs is kept, and a route only
+regresses when its p95 or its time per request is worse by more than --tolerance (20%) and by more
+than --floor-ms (1ms). Timings are only compared against a baseline saved with --timings on the same
+machine, keep those baselines out of the repository.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--database", help="database url, the tables are dropped and created again (needs --reset)")
+parser.add_argument("--reset", action="store_true")
+parser.add_argument("--users", type=int, default=50)
+parser.add_argument("--people", type=int, default=5000)
+parser.add_argument("--planets", type=int, default=500)
+parser.add_argument("--favourites", type=int, default=10, help="per user")
+parser.add_argument("--requests", type=int, default=200, help="per scenario")
+parser.add_argument("--mode", choices=("client", "server", "both"), default="client")
+parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+parser.add_argument("--concurrency", type=int, default=8, help="client threads against gunicorn")
+parser.add_argument("--gunicorn-args", default="", help="extra gunicorn arguments, e.g. \"--worker-class sync\" (gunicorn.conf.py is used too)")
+parser.add_argument("--only", nargs="+", help="scenarios to run, by name")
+parser.add_argument("--baseline")
+parser.add_argument("--save-baseline")
+parser.add_argument("--timings", action="store_true", help="save and compare the timings too, not only the query counts")
+parser.add_argument("--runs", type=int, default=3, help="runs of every mode with --timings, their median is kept")
+parser.add_argument("--tolerance", type=float, default=0.2)
+parser.add_argument("--floor-ms", type=float, default=1.0, help="timing changes smaller than this never regress")
+args = parser.parse_args()
+
+if args.database and not args.reset:
+    parser.error("--database drops every table of that database, add --reset to confirm")
+database = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'api.db')}"
+os.environ["DATABASE_URL"] = database
+# every request comes from one IP and a handful of accounts, the limits of ratelimit.py would refuse most of them
+for limit in ("RATELIMIT_LOGIN_IP", "RATELIMIT_LOGIN_EMAIL", "RATELIMIT_SIGNUP_IP"):
+    os.environ.setdefault(limit, "1000000/1")
+# nothing is revoked during a run, the periodic sync of revocation.py would add a query to random requests
+os.environ.setdefault("REVOCATION_SYNC_SECONDS", "3600")
+# nor are the users changed, an expiring entry of the user cache of auth.py would add a lookup to random requests
+os.environ.setdefault("AUTH_USER_CACHE_TTL", "3600")
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+CONFIG = os.path.join(SRC, "..", "gunicorn.conf.py")
+sys.path.insert(0, SRC)
+
+from sqlalchemy import event
+from app import app
+from models import db, User, People, Planets, Favourites, FavouriteCount
+from passwords import hash_password_sync
+from links import sync_links
+
+PASSWORD = "benchmark password"
+
+
+@contextmanager
+def count_queries():
+    """Collects every SQL statement sent while the block runs, needs an app context"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    stored = hash_password_sync(PASSWORD)
+    db.session.execute(User.__table__.insert(), [
+        {"email": f"user{i}@bench.test", "password": stored} for i in range(args.users)
+    ])
+    planets = [
+        {"name": f"planet {i}", "diameter": 12500, "rotation_period": 24, "orbital_period": 364, "gravity": 1.0 + i % 3,
+         "population": 1000 * i, "climate": ("arid", "temperate", "frozen")[i % 3], "terrain": "grasslands, mountains",
+         "surface_water": 40, "species": "Human", "films": "A New Hope, Revenge of the Sith"}
+        for i in range(args.planets)
+    ]
+    people = [
+        {"name": f"person {i}", "birth_year": i % 100, "eye_color": "blue", "gender": ("male", "female")[i % 2],
+         "hair_color": "blond", "height": 172, "weight": 77, "skin_color": "fair", "species": "Human",
+         "starships": "X-wing, Imperial shuttle", "vehicles": "Snowspeeder",
+         "films": ("A New Hope, The Empire Strikes Back", "Return of the Jedi")[i % 2], "homeworld_id": i % args.planets + 1}
+        for i in range(args.people)
+    ]
+    db.session.execute(Planets.__table__.insert(), planets)
+    db.session.execute(People.__table__.insert(), people)
+    # the ids are 1..n on the fresh tables
+    sync_links(db.session.connection(), Planets, dict(enumerate(planets, start=1)), replace=False)
+    sync_links(db.session.connection(), People, dict(enumerate(people, start=1)), replace=False)
+    # the first favourites of every user, the write scenarios use the planets and people after these
+    db.session.execute(Favourites.__table__.insert(), [
+        {"users_favourites_id": user + 1, "people_favourites_id": favourite + 1}
+        for user in range(args.users) for favourite in range(args.favourites)
+    ])
+    db.session.execute(FavouriteCount.__table__.insert(), [
+        {"kind": "people", "entity_id": favourite + 1, "total": args.users} for favourite in range(args.favourites)
+    ])
+    db.session.commit()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, status, queries=None):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if status >= 400:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if queries is not None:
+                self.queries.setdefault(name, []).append(queries)
+
+
+class ClientDriver:
+    """Flask test client, in process, counts the statements of every request"""
+
+    def __init__(self, recorder):
+        self.client = app.test_client()
+        self.recorder = recorder
+
+    def request(self, name, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        with app.app_context(), count_queries() as statements:
+            start = time.perf_counter()
+            response = self.client.open(path, method=method, json=body, headers=headers)
+            data = response.get_data()
+            elapsed = time.perf_counter() - start
+        self.recorder.add(name, elapsed, response.status_code, len(statements))
+        return response.status_code, json.loads(data) if response.is_json else None
+
+
+class HttpDriver:
+    """Keep-alive HTTP connection to the gunicorn server, one per client thread"""
+
+    def __init__(self, recorder, port):
+        self.recorder = recorder
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, name, method, path, body=None, token=None):
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        start = time.perf_counter()
+        try:
+            self.local.connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.local.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.local.connection.close()
+            self.local.connection = None
+            self.recorder.add(name, time.perf_counter() - start, 599)
+            return 599, None
+        elapsed = time.perf_counter() - start
+        self.recorder.add(name, elapsed, response.status)
+        is_json = (response.getheader("Content-Type") or "").startswith("application/json")
+        return response.status, json.loads(data) if is_json and data else None
+
+
+# every scenario is called with (driver, user, i): user is the seeded user of the client thread
+# (its index and token), i the number of the iteration. The favourite writes undo what they do,
+# the catalogue writes and signups use fresh names.
+def login(driver, user, i):
+    driver.request("POST /login", "POST", "/login", {"email": f"user{user['index']}@bench.test", "password": PASSWORD})
+
+def refresh(driver, user, i):
+    driver.request("POST /refresh", "POST", "/refresh", token=user["refresh_token"])
+
+def logout(driver, user, i):
+    # revokes a pair of its own, the user's tokens keep working for the other scenarios
+    status, body = driver.request("setup", "POST", "/login", {"email": f"user{user['index']}@bench.test", "password": PASSWORD})
+    if status == 200:
+        driver.request("POST /logout", "POST", "/logout", {"refresh_token": body["refresh_token"]}, token=body["access_token"])
+
+def signup(driver, user, i):
+    driver.request("POST /signup", "POST", "/signup", {"email": f"new-{secrets.token_hex(6)}@bench.test", "password": PASSWORD})
+
+def favourite_planet(driver, user, i):
+    planet = (args.favourites + i) % args.planets + 1
+    status, body = driver.request("POST /favorite/planet/<id>", "POST", f"/favorite/planet/{planet}", token=user["token"])
+    if status == 200:
+        # deleted by favourite id, like DELETE /user/favorites/<id>
+        driver.request("DELETE /favorite/planet/<id>", "DELETE", f"/favorite/planet/{body['id']}", token=user["token"])
+
+def favourite_person(driver, user, i):
+    person = (args.favourites + i) % args.people + 1
+    status, body = driver.request("POST /favorite/people/<id>", "POST", f"/favorite/people/{person}", token=user["token"])
+    if status == 200:
+        driver.request("DELETE /user/favorites/<id>", "DELETE", f"/user/favorites/{body['id']}", token=user["token"])
+
+def unfavourite_person(driver, user, i):
+    person = (args.favourites + i) % args.people + 1
+    status, body = driver.request("POST /favorite/people/<id>", "POST", f"/favorite/people/{person}", token=user["token"])
+    if status == 200:
+        driver.request("DELETE /favorite/people/<id>", "DELETE", f"/favorite/people/{body['id']}", token=user["token"])
+
+def favourites_batch(driver, user, i):
+    people = [(args.favourites + i * 5 + offset) % args.people + 1 for offset in range(5)]
+    driver.request("POST /user/favorites/batch", "POST", "/user/favorites/batch", {"add": {"people": people}}, token=user["token"])
+    driver.request("POST /user/favorites/batch", "POST", "/user/favorites/batch", {"remove": {"people": people}}, token=user["token"])
+
+def add_person(driver, user, i):
+    driver.request("POST /people", "POST", "/people", {"name": f"new person {secrets.token_hex(6)}", "homeworld_id": i % args.planets + 1})
+
+def add_planet(driver, user, i):
+    driver.request("POST /planets", "POST", "/planets", {"name": f"new planet {secrets.token_hex(6)}"})
+
+def bulk_people(driver, user, i):
+    prefix = secrets.token_hex(6)
+    records = [{"name": f"bulk person {prefix} {n}"} for n in range(20)]
+    driver.request("POST /people/bulk", "POST", "/people/bulk", records)
+
+def bulk_planets(driver, user, i):
+    prefix = secrets.token_hex(6)
+    records = [{"name": f"bulk planet {prefix} {n}"} for n in range(20)]
+    driver.request("POST /planets/bulk", "POST", "/planets/bulk", records)
+
+def read(path, name=None):
+    def scenario(driver, user, i):
+        driver.request(name or f"GET {path}", "GET", path.format(i=i, person=i % args.people + 1, planet=i % args.planets + 1, film=i % 4 + 1),
+                       token=user["token"])
+    return scenario
+
+SCENARIOS = {
+    "sitemap": read("/", "GET /"),
+    "users": read("/users?limit=50"),
+    "people": read("/people?limit=100"),
+    "people fields": read("/people?limit=100&fields=name,image"),
+    "people search": read("/people?q=hope&gender=female&sort=-birth_year&limit=50"),
+    "person": read("/people/{person}", "GET /people/<id>"),
+    "planets": read("/planets?limit=100"),
+    "planet": read("/planets/{planet}", "GET /planets/<id>"),
+    "planet stats": read("/planets/stats"),
+    "people stats": read("/people/stats"),
+    "films": read("/films?limit=100"),
+    "film": read("/films/{film}", "GET /films/<id>"),
+    "film people": read("/films/{film}/people?limit=100", "GET /films/<id>/people"),
+    "film planets": read("/films/{film}/planets?limit=100", "GET /films/<id>/planets"),
+    "popular people": read("/people/popular?limit=50"),
+    "popular planets": read("/planets/popular?limit=50"),
+    "favourites": read("/user/favorites"),
+    "health": read("/health"),
+    "metrics": read("/metrics"),
+    "cache stats": read("/cache/stats"),
+    "login": login,
+    "refresh": refresh,
+    "logout": logout,
+    "signup": signup,
+    "favourite planet": favourite_planet,
+    "favourite person": favourite_person,
+    "unfavourite person": unfavourite_person,
+    "favourites batch": favourites_batch,
+    "add person": add_person,
+    "add planet": add_planet,
+    "bulk people": bulk_people,
+    "bulk planets": bulk_planets,
+}
+
+
+def tokens(driver):
+    users = []
+    for index in range(args.users):
+        status, body = driver.request("setup", "POST", "/login", {"email": f"user{index}@bench.test", "password": PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"login of user{index} failed with {status}")
+        users.append({"index": index, "token": body["access_token"], "refresh_token": body["refresh_token"]})
+    # the first authenticated request loads the revocation list
+    driver.request("setup", "GET", "/user/favorites", token=users[0]["token"])
+    return users
+
+
+def run(driver, users, threads):
+    for name, scenario in SCENARIOS.items():
+        if args.only and name not in args.only:
+            continue
+
+        def worker(thread):
+            user = users[thread % len(users)]
+            for i in range(thread, args.requests, threads):
+                scenario(driver, user, i)
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(threads)))
+
+
+def start_server():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "--config", CONFIG, "--chdir", SRC, "--bind", f"127.0.0.1:{port}",
+               "--workers", str(args.workers), "--log-level", "warning", *args.gunicorn_args.split()]
+    server = subprocess.Popen(command, env=os.environ.copy())
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn didn't start")
+
+
+def measure(mode):
+    recorder = Recorder()
+    if mode == "client":
+        driver, threads, server = ClientDriver(recorder), 1, None
+    else:
+        server, port = start_server()
+        driver, threads = HttpDriver(recorder, port), args.concurrency
+    try:
+        users = tokens(driver)
+        started = time.perf_counter()
+        run(driver, users, threads)
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    results = {}
+    for name, samples in recorder.samples.items():
+        if name == "setup" or len(samples) < 2:
+            continue
+        cuts = statistics.quantiles(samples, n=100)
+        results[name] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(name, 0),
+            # per route: how many of its requests the threads could complete per second of their time
+            "throughput": threads * len(samples) / sum(samples),
+            "p50_ms": cuts[49] * 1000,
+            "p95_ms": cuts[94] * 1000,
+            "p99_ms": cuts[98] * 1000,
+        }
+        if name in recorder.queries:
+            # the most any request of the route needed: cache hits need fewer, an N+1 shows up here
+            results[name]["queries"] = max(recorder.queries[name])
+    total = sum(len(samples) for name, samples in recorder.samples.items() if name != "setup")
+    results["total"] = {"requests": total, "throughput": total / elapsed}
+    return results
+
+
+def median_results(runs):
+    """The median of every timing of the runs, the most queries any of them needed"""
+    results = {}
+    for name in runs[0]:
+        samples = [run[name] for run in runs if name in run]
+        results[name] = {key: statistics.median(sample[key] for sample in samples) for key in samples[0] if key != "queries"}
+        if "queries" in samples[0]:
+            results[name]["queries"] = max(sample["queries"] for sample in samples)
+    return results
+
+
+def report(mode, results):
+    width = max(len(name) for name in results) + 2
+    print(f"\n{mode} ({'1 thread' if mode == 'client' else f'{args.workers} workers, {args.concurrency} threads'})")
+    print(f"{'route':<{width}} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+    for name, result in results.items():
+        if name == "total":
+            continue
+        queries = result.get("queries", "-")
+        print(f"{name:<{width}} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>9.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {queries:>8}")
+    print(f"{'total':<{width}} {results['total']['requests']:>8} {'':>6} {results['total']['throughput']:>9.1f}")
+
+
+def machine():
+    return f"{platform.node()} {platform.machine()} {os.cpu_count()} cpus, python {platform.python_version()}"
+
+
+def saved(current):
+    """What --save-baseline keeps: the query counts, and the timings with --timings"""
+    if args.timings:
+        return {"machine": machine(), "results": current}
+    return {"results": {
+        mode: {name: {"queries": result["queries"]} for name, result in results.items() if "queries" in result}
+        for mode, results in current.items()
+    }}
+
+
+def regressions(baseline, current, tolerance, floor_ms):
+    # timings only mean something against the same machine, the query counts always do
+    timed = args.timings and baseline.get("machine") == machine()
+    found = []
+    for mode, results in current.items():
+        for name, result in results.items():
+            before = baseline["results"].get(mode, {}).get(name)
+            if before is None or name == "total":
+                continue
+            if "queries" in result and "queries" in before and result["queries"] > before["queries"]:
+                found.append(f"{mode} {name}: {result['queries']} queries per request, was {before['queries']}")
+            if not timed:
+                continue
+            if result["p95_ms"] > before["p95_ms"] * (1 + tolerance) and result["p95_ms"] - before["p95_ms"] > floor_ms:
+                found.append(f"{mode} {name}: p95 {result['p95_ms']:.2f}ms, was {before['p95_ms']:.2f}ms")
+            # compared as the time per request, so the floor applies to it as well
+            per_request, before_per_request = 1000 / result["throughput"], 1000 / before["throughput"]
+            if per_request > before_per_request * (1 + tolerance) and per_request - before_per_request > floor_ms:
+                found.append(f"{mode} {name}: {result['throughput']:.1f} req/s, was {before['throughput']:.1f}")
+    if args.timings and not timed:
+        where = f"another machine ({baseline['machine']})" if "machine" in baseline else "a run without --timings"
+        print(f"\nthe baseline comes from {where}, only the query counts are compared")
+    return found
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        seed()
+    current = {}
+    for mode in (("client", "server") if args.mode == "both" else (args.mode,)):
+        current[mode] = median_results([measure(mode) for _ in range(args.runs if args.timings else 1)])
+        report(mode, current[mode])
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(saved(current), file, indent=2, sort_keys=True)
+        print(f"\nbaseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(json.load(file), current, args.tolerance, args.floor_ms)
+        print("\n" + ("\n".join(found) if found else "no regressions against " + args.baseline))
+        sys.exit(1 if found else 0)
@@ -0,0 +1,73 @@
+"""
+The gunicorn worker profiles of gunicorn.conf.py against each other: one worker of each, driven by
+the same number of concurrent clients through the I/O bound routes (login, favourites, reads).
+Runs benchmarks/api.py in server mode once per profile and puts the results side by side.
+
+    $ python benchmarks/concurrency.py
+    $ python benchmarks/concurrency.py --concurrency 64 --threads 16 --requests 400
+    $ python benchmarks/concurrency.py --database postgresql://localhost/bench --reset
+
+SQLite answers from the same machine in microseconds, the threads and greenlets have much more
+to overlap against a real database server (--database).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SCENARIOS = ["login", "favourites", "favourite planet", "favourites batch", "people", "person"]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--concurrency", type=int, default=32)
+parser.add_argument("--requests", type=int, default=300, help="per scenario")
+parser.add_argument("--threads", type=int, default=8, help="threads of the gthread worker")
+parser.add_argument("--connections", type=int, default=100, help="greenlets of the gevent worker")
+parser.add_argument("--database")
+parser.add_argument("--reset", action="store_true")
+args = parser.parse_args()
+
+
+def profiles():
+    yield "sync", {"GUNICORN_WORKER_CLASS": "sync"}
+    yield f"gthread x{args.threads}", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_THREADS": str(args.threads)}
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("gevent isn't installed, skipping the gevent profile", file=sys.stderr)
+        return
+    yield f"gevent x{args.connections}", {"GUNICORN_WORKER_CLASS": "gevent", "GUNICORN_WORKER_CONNECTIONS": str(args.connections)}
+
+
+def measure(env):
+    output = os.path.join(tempfile.mkdtemp(), "results.json")
+    command = [sys.executable, os.path.join(os.path.dirname(__file__), "api.py"), "--mode", "server", "--workers", "1",
+               "--concurrency", str(args.concurrency), "--requests", str(args.requests), "--only", *SCENARIOS,
+               "--save-baseline", output]
+    if args.database:
+        command += ["--database", args.database] + (["--reset"] if args.reset else [])
+    # the pool must not be what limits the threads and greenlets
+    pool = {"DB_POOL_SIZE": str(max(args.threads, 5)), "DB_MAX_OVERFLOW": str(args.connections)}
+    # every request is "slow" under this load, the log would drown the results
+    quiet = {"METRICS_SLOW_MS": "60000"}
+    subprocess.run(command, env={**os.environ, **pool, **quiet, **env}, check=True, stdout=subprocess.DEVNULL)
+    with open(output) as file:
+        return json.load(file)["results"]["server"]
+
+
+if __name__ == "__main__":
+    results = {name: measure(env) for name, env in profiles()}
+    routes = [route for route in next(iter(results.values())) if route != "total"]
+    width = max(len(route) for route in routes) + 2
+    print(f"1 worker per profile, {args.concurrency} concurrent clients\n")
+    print(f"{'req/s':<{width}}" + "".join(f"{name:>16}" for name in results))
+    for route in routes + ["total"]:
+        print(f"{route:<{width}}" + "".join(f"{profile[route]['throughput']:>16.1f}" if route in profile else f"{'-':>16}" for profile in results.values()))
+    print(f"\n{'p95 ms':<{width}}" + "".join(f"{name:>16}" for name in results))
+    for route in routes:
+        print(f"{route:<{width}}" + "".join(f"{profile[route]['p95_ms']:>16.1f}" if route in profile else f"{'-':>16}" for profile in results.values()))
+    # 503s on login are the password hashing pool refusing work (PASSWORD_HASH_WORKERS / _QUEUE), not failures
+    print(f"\n{'errors':<{width}}" + "".join(f"{name:>16}" for name in results))
+    for route in routes:
+        print(f"{route:<{width}}" + "".join(f"{profile[route]['errors']:>16}" if route in profile else f"{'-':>16}" for profile in results.values()))
@@ -0,0 +1,40 @@
+"""
+Login throughput per core for each scrypt cost, to pick PASSWORD_SCRYPT_N / R / P.
+Every login verifies one hash, so verifications per second on one thread is the ceiling
+of logins per second per core.
+
+    $ python benchmarks/password_hashing.py
+    $ python benchmarks/password_hashing.py --seconds 5 --n 16384 32768 --r 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from passwords import hash_password_sync, verify_password_sync
+
+
+def logins_per_second(cost, seconds):
+    stored = hash_password_sync("correct horse battery staple", cost)
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        verify_password_sync("correct horse battery staple", stored, cost)
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, nargs="+", default=[2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16])
+    parser.add_argument("--r", type=int, default=8)
+    parser.add_argument("--p", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    print(f"{'N':>8} {'r':>3} {'p':>3} {'memory':>9} {'ms/login':>9} {'logins/s/core':>14}")
+    for n in args.n:
+        rate = logins_per_second((n, args.r, args.p), args.seconds)
+        memory = 128 * n * args.r // 1024 // 1024
+        print(f"{n:>8} {args.r:>3} {args.p:>3} {memory:>7}MB {1000 / rate:>9.1f} {rate:>14.1f}")
@@ -0,0 +1,89 @@
+"""
+Rows per second of the /people and /planets list serialization: the ORM path (select(Model) with the
+serializer profile + serialize() + stdlib json) against the column projections + orjson used by the
+endpoints, plus the endpoints themselves through the Flask test client (cache cleared on every call).
+
+    $ python benchmarks/serializers.py
+    $ python benchmarks/serializers.py --people 50000 --planets 2000 --repeat 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--people", type=int, default=20000)
+parser.add_argument("--planets", type=int, default=1000)
+parser.add_argument("--repeat", type=int, default=3)
+args = parser.parse_args()
+
+database = os.path.join(tempfile.mkdtemp(), "serializers.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import app
+from cache import cache
+from models import db, People, Planets, serializer_options, PEOPLE_PROJECTION, PLANETS_PROJECTION
+from utils import orjson
+
+
+def seed():
+    db.create_all()
+    db.session.execute(Planets.__table__.insert(), [
+        {"name": f"planet {i}", "diameter": 12500, "rotation_period": 24, "orbital_period": 364, "gravity": 1.0,
+         "population": 2000000000, "climate": "temperate", "terrain": "grasslands, mountains", "surface_water": 40,
+         "species": "Human", "films": "A New Hope, Revenge of the Sith"}
+        for i in range(args.planets)
+    ])
+    db.session.execute(People.__table__.insert(), [
+        {"name": f"person {i}", "birth_year": 19, "eye_color": "blue", "gender": "male", "hair_color": "blond",
+         "height": 172, "weight": 77, "skin_color": "fair", "species": "Human", "starships": "X-wing, Imperial shuttle",
+         "vehicles": "Snowspeeder", "films": "A New Hope, The Empire Strikes Back, Return of the Jedi",
+         "homeworld_id": i % args.planets + 1}
+        for i in range(args.people)
+    ])
+    db.session.commit()
+
+
+def best_rate(rows, fn):
+    best = None
+    for _ in range(args.repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def orm_path(model):
+    items = db.session.scalars(db.select(model).options(*serializer_options(model)).order_by(model.id)).all()
+    return json.dumps({"results": [item.serialize() for item in items]}, separators=(",", ":"), sort_keys=True)
+
+def projection_path(projection, model):
+    rows = db.session.execute(projection.select().order_by(model.id)).all()
+    return app.json.dumps({"results": projection.serializer()(rows)})
+
+def endpoint(client, url):
+    cache.backend.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    response.get_data()
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        seed()
+        client = app.test_client()
+        print(f"json backend: {'orjson' if orjson is not None and type(app.json).__name__ == 'OrjsonProvider' else 'stdlib'}")
+        print(f"{'list':>8} {'rows':>7} {'orm + json':>14} {'projection':>14} {'endpoint':>14}   (rows/s)")
+        for name, model, projection, rows in (
+            ("people", People, PEOPLE_PROJECTION, args.people),
+            ("planets", Planets, PLANETS_PROJECTION, args.planets),
+        ):
+            before = best_rate(rows, lambda: orm_path(model))
+            after = best_rate(rows, lambda: projection_path(projection, model))
+            served = best_rate(rows, lambda: endpoint(client, f"/{name}"))
+            print(f"{name:>8} {rows:>7} {before:>14,.0f} {after:>14,.0f} {served:>14,.0f}")
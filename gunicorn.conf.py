@@ -0,0 +1,56 @@
+"""
+gunicorn settings, used by the Procfile and render.yaml (`gunicorn -c gunicorn.conf.py wsgi --chdir ./src/`).
+The default profile is gthread: WEB_CONCURRENCY processes (2) with GUNICORN_THREADS threads each, every
+thread serves a request while the others wait on the database, the password hashing pool or the
+client. GUNICORN_WORKER_CLASS=gevent switches to greenlets (`pipenv install gevent`, plus psycogreen
+on Postgres so psycopg2 waits cooperatively) for many more concurrent, mostly idle connections.
+GUNICORN_WORKER_CLASS=sync goes back to one request per process.
+Flask-SQLAlchemy gives every request its own session, whatever the worker class. Each thread or
+greenlet holds at most one connection, DB_POOL_SIZE + DB_MAX_OVERFLOW (src/database.py) should
+cover GUNICORN_THREADS / GUNICORN_WORKER_CONNECTIONS or requests wait for a free connection.
+Every worker is a copy of the app with its own pool, password hashing threads, caches and local rate
+limit buckets, so WEB_CONCURRENCY is a small fixed number rather than the cores a container reports:
+WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections have to fit DATABASE_MAX_CONNECTIONS
+(100, the Postgres default, 20 on the smallest Heroku plans).
+See benchmarks/concurrency.py for the profiles against each other.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3000)}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# the workers size their password hashing pool and check the rate limit backend with it
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# workers are replaced now and then, bounds whatever a long running process could leak
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            return
+        patch_psycopg()
+
+
+def when_ready(server):
+    pool = int(os.getenv("DB_POOL_SIZE", 5)) + int(os.getenv("DB_MAX_OVERFLOW", 10))
+    concurrency = {"gthread": threads, "gevent": worker_connections}.get(worker_class, 1)
+    if concurrency > pool:
+        server.log.warning(
+            "%s workers serve up to %d requests at once each but the pool holds %d connections, "
+            "raise DB_POOL_SIZE/DB_MAX_OVERFLOW or lower the concurrency", worker_class, concurrency, pool
+        )
+    max_connections = int(os.getenv("DATABASE_MAX_CONNECTIONS", 100))
+    # SQLite has no server side limit, and no pool sized by these settings
+    if workers * pool > max_connections and not os.getenv("DATABASE_URL", "").startswith("sqlite"):
+        server.log.warning(
+            "%d workers with %d connections each can open %d connections, the database accepts %d, "
+            "lower WEB_CONCURRENCY or DB_POOL_SIZE/DB_MAX_OVERFLOW", workers, pool, workers * pool, max_connections
+        )
@@ -0,0 +1,51 @@
+"""hash the passwords still stored in plain text
+
+Revision ID: 1bcd569d5e42
+Revises: 9d555b41fc6c
+Create Date: 2026-10-17 20:02:47.109385
+
+"""
+import base64
+import hashlib
+import secrets
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1bcd569d5e42'
+down_revision = '9d555b41fc6c'
+branch_labels = None
+depends_on = None
+
+# same format and default cost as passwords.hash_password_sync, a hash made with another cost
+# than PASSWORD_SCRYPT_* is upgraded on the next login
+PREFIX = 'scrypt'
+N, R, P = 2 ** 14, 8, 1
+BATCH_SIZE = 500
+
+
+def b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def hash_password(password):
+    salt = secrets.token_bytes(16)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=N, r=R, p=P, maxmem=256 * N * R + 1024 * 1024, dklen=32)
+    return f'{PREFIX}${N}${R}${P}${b64(salt)}${b64(key)}'
+
+
+def upgrade():
+    # the accounts created before passwords were hashed (910729335c64) whose owners never logged in since
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.text('SELECT id, password FROM "user" WHERE password NOT LIKE :hashed'), {'hashed': PREFIX + '$%'}
+    ).all()
+    for start in range(0, len(rows), BATCH_SIZE):
+        hashed = [{'user_id': user_id, 'password': hash_password(password)} for user_id, password in rows[start:start + BATCH_SIZE]]
+        connection.execute(sa.text('UPDATE "user" SET password = :password WHERE id = :user_id'), hashed)
+
+
+def downgrade():
+    # the plain passwords are gone, the hashes work with every revision
+    pass
@@ -0,0 +1,79 @@
+"""indexes for the people/planets filters and the name/films text search
+
+Revision ID: 3517c58f2b1f
+Revises: 910729335c64
+Create Date: 2026-10-17 13:52:07.418220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3517c58f2b1f'
+down_revision = '910729335c64'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_people_gender', 'people', 'gender'),
+    ('ix_people_species', 'people', 'species'),
+    ('ix_people_eye_color', 'people', 'eye_color'),
+    ('ix_people_hair_color', 'people', 'hair_color'),
+    ('ix_people_skin_color', 'people', 'skin_color'),
+    ('ix_people_birth_year', 'people', 'birth_year'),
+    ('ix_people_homeworld_id', 'people', 'homeworld_id'),
+    ('ix_planets_climate', 'planets', 'climate'),
+    ('ix_planets_terrain', 'planets', 'terrain'),
+    ('ix_planets_population', 'planets', 'population'),
+    ('ix_planets_gravity', 'planets', 'gravity'),
+)
+
+
+def fts5_upgrade(table):
+    op.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5(name, films, content='{table}', content_rowid='id')")
+    op.execute(
+        f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_fts(rowid, name, films) VALUES (new.id, new.name, new.films); END"
+    )
+    op.execute(
+        f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name, films) VALUES ('delete', old.id, old.name, old.films); END"
+    )
+    op.execute(
+        f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF name, films ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name, films) VALUES ('delete', old.id, old.name, old.films); "
+        f"INSERT INTO {table}_fts(rowid, name, films) VALUES (new.id, new.name, new.films); END"
+    )
+    # indexes the rows that are already there
+    op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+def fts5_downgrade(table):
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+    op.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+def upgrade():
+    for name, table, column in INDEXES:
+        op.create_index(name, table, [column], unique=False)
+    dialect = op.get_bind().dialect.name
+    for table in ('people', 'planets'):
+        if dialect == 'sqlite':
+            fts5_upgrade(table)
+        elif dialect == 'postgresql':
+            # the same expression as models.search_document, the queries only use the index if they match
+            op.create_index(f'ix_{table}_search', table,
+                            [sa.text("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(films, ''))")],
+                            postgresql_using='gin')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in ('people', 'planets'):
+        if dialect == 'sqlite':
+            fts5_downgrade(table)
+        elif dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_search', table_name=table)
+    for name, table, column in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,59 @@
+"""case insensitive unique names for people and planets
+
+Revision ID: 6bd1b745cc4b
+Revises: d6c055451e82
+Create Date: 2026-10-17 10:12:31.508214
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6bd1b745cc4b'
+down_revision = 'd6c055451e82'
+branch_labels = None
+depends_on = None
+
+log = logging.getLogger('alembic.runtime.migration')
+
+# the columns pointing at each table when this revision runs
+REFERENCES = {
+    'people': [('favourites', 'people_favourites_id')],
+    'planets': [('favourites', 'planet_favourites_id'), ('people', 'homeworld_id')],
+}
+
+
+def merge_case_duplicates(table):
+    """
+    The old racy check (and the admin) could store names that only differ in case: keeps the lowest
+    id of each name, points the favourites and homeworlds of the others at it and deletes them
+    """
+    connection = op.get_bind()
+    duplicates = f'SELECT id FROM {table} WHERE name IS NOT NULL AND id NOT IN (SELECT min(id) FROM {table} GROUP BY lower(name))'
+    names = connection.execute(sa.text(f'SELECT name FROM {table} WHERE id IN ({duplicates}) ORDER BY name')).scalars().all()
+    if not names:
+        return
+    log.warning('merging %s whose names only differ in case into the lowest id: %s', table, ', '.join(names))
+    for referencing, column in REFERENCES[table]:
+        op.execute(
+            f'UPDATE {referencing} SET {column} = ('
+            f'SELECT min(kept.id) FROM {table} kept JOIN {table} duplicate ON lower(kept.name) = lower(duplicate.name) '
+            f'WHERE duplicate.id = {referencing}.{column}) '
+            f'WHERE {column} IN ({duplicates})'
+        )
+    op.execute(f'DELETE FROM {table} WHERE id IN ({duplicates})')
+
+
+def upgrade():
+    # the repeated favourites this can make are removed by fc7039645b5a
+    merge_case_duplicates('people')
+    merge_case_duplicates('planets')
+    op.create_index('ix_people_name_lower', 'people', [sa.text('lower(name)')], unique=True)
+    op.create_index('ix_planets_name_lower', 'planets', [sa.text('lower(name)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_planets_name_lower', table_name='planets')
+    op.drop_index('ix_people_name_lower', table_name='people')
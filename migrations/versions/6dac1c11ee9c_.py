@@ -0,0 +1,41 @@
+"""unique index on the lowercased user email
+
+Revision ID: 6dac1c11ee9c
+Revises: 6bd1b745cc4b
+Create Date: 2026-10-17 10:48:02.117935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6dac1c11ee9c'
+down_revision = '6bd1b745cc4b'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('email', sa.String))
+
+
+def upgrade():
+    # accounts whose emails only differ in case or spaces would collide, their owners have to
+    # choose which one stays: merging them here would hand one person's favourites and login to another
+    normalized = sa.func.lower(sa.func.trim(user.c.email))
+    colliding = sa.select(normalized).group_by(normalized).having(sa.func.count() > 1).scalar_subquery()
+    conflicts = op.get_bind().execute(
+        sa.select(user.c.id, user.c.email).where(normalized.in_(colliding)).order_by(normalized, user.c.id)
+    ).all()
+    if conflicts:
+        accounts = ', '.join(f'{user_id} ({email})' for user_id, email in conflicts)
+        raise RuntimeError(
+            f'these accounts only differ in the case or spaces of their email, delete or rename all but one of each '
+            f'before upgrading: {accounts}'
+        )
+    # the app stores emails lowercased from now on, bring the existing ones in line
+    op.execute(user.update().values(email=sa.func.lower(sa.func.trim(user.c.email))))
+    op.create_index('ix_user_email', 'user', ['email'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_email', table_name='user')
@@ -0,0 +1,93 @@
+"""films, starships, vehicles and species tables, linked to people and planets
+
+Revision ID: 8d04fd478da3
+Revises: 3517c58f2b1f
+Create Date: 2026-10-17 18:55:43.107215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d04fd478da3'
+down_revision = '3517c58f2b1f'
+branch_labels = None
+depends_on = None
+
+ENTITIES = ('films', 'starships', 'vehicles', 'species')
+# association table, owner, owner column, entity, entity column
+ASSOCIATIONS = (
+    ('people_films', 'people', 'people_id', 'films', 'film_id'),
+    ('people_starships', 'people', 'people_id', 'starships', 'starship_id'),
+    ('people_vehicles', 'people', 'people_id', 'vehicles', 'vehicle_id'),
+    ('people_species', 'people', 'people_id', 'species', 'species_id'),
+    ('planets_films', 'planets', 'planet_id', 'films', 'film_id'),
+    ('planets_species', 'planets', 'planet_id', 'species', 'species_id'),
+)
+# same as models.UNKNOWN
+BLANK = {'', 'n/a', 'none', 'unknown'}
+
+
+def split_names(value):
+    # same as links.split_names
+    names = {}
+    for name in (value or '').split(','):
+        name = ' '.join(name.split())
+        if name.lower() not in BLANK:
+            names.setdefault(name.lower(), name)
+    return list(names.values())
+
+
+def fill(connection):
+    """Splits the strings already in people and planets into entities and association rows"""
+    # entity -> {lowercased name: name}, association table -> [(owner id, lowercased name)]
+    names = {entity: {} for entity in ENTITIES}
+    links = {association: [] for association, *_ in ASSOCIATIONS}
+    for association, owner, owner_column, entity, entity_column in ASSOCIATIONS:
+        # the string column has the name of the entity table
+        for owner_id, value in connection.execute(sa.text(f"SELECT id, {entity} FROM {owner} WHERE {entity} IS NOT NULL")):
+            for name in split_names(value):
+                names[entity].setdefault(name.lower(), name)
+                links[association].append((owner_id, name.lower()))
+    ids = {}
+    for entity in ENTITIES:
+        table = sa.table(entity, sa.column('name'))
+        if names[entity]:
+            op.bulk_insert(table, [{'name': name} for name in names[entity].values()])
+        ids[entity] = dict(connection.execute(sa.text(f"SELECT lower(name), id FROM {entity}")).all())
+    for association, owner, owner_column, entity, entity_column in ASSOCIATIONS:
+        table = sa.table(association, sa.column(owner_column), sa.column(entity_column))
+        rows = [{owner_column: owner_id, entity_column: ids[entity][name]} for owner_id, name in links[association]]
+        if rows:
+            op.bulk_insert(table, rows)
+
+
+def upgrade():
+    for entity in ENTITIES:
+        op.create_table(entity,
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=250), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(f'ix_{entity}_name_lower', entity, [sa.text('lower(name)')], unique=True)
+    for association, owner, owner_column, entity, entity_column in ASSOCIATIONS:
+        op.create_table(association,
+            sa.Column(owner_column, sa.Integer(), nullable=False),
+            sa.Column(entity_column, sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint([owner_column], [f'{owner}.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint([entity_column], [f'{entity}.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint(owner_column, entity_column)
+        )
+        op.create_index(f'ix_{association}_{entity_column}', association, [entity_column, owner_column], unique=False)
+    fill(op.get_bind())
+
+
+def downgrade():
+    # the strings were never touched, only the tables made from them go
+    for association, owner, owner_column, entity, entity_column in reversed(ASSOCIATIONS):
+        op.drop_index(f'ix_{association}_{entity_column}', table_name=association)
+        op.drop_table(association)
+    for entity in reversed(ENTITIES):
+        op.drop_index(f'ix_{entity}_name_lower', table_name=entity)
+        op.drop_table(entity)
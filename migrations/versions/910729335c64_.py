@@ -0,0 +1,33 @@
+"""room for password hashes in user.password
+
+Revision ID: 910729335c64
+Revises: cee2712f85db
+Create Date: 2026-10-17 12:41:19.284371
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '910729335c64'
+down_revision = 'cee2712f85db'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the plain passwords left are hashed by a later revision
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=80),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=80),
+               existing_nullable=False)
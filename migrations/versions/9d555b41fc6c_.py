@@ -0,0 +1,42 @@
+"""favourite counts of people and planets, backfilled from favourites
+
+Revision ID: 9d555b41fc6c
+Revises: cf9843cc6846
+Create Date: 2026-10-17 19:38:26.417305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d555b41fc6c'
+down_revision = 'cf9843cc6846'
+branch_labels = None
+depends_on = None
+
+# kind -> favourites column, same as favourites.KINDS
+KINDS = (
+    ('people', 'people_favourites_id'),
+    ('planets', 'planet_favourites_id'),
+)
+
+
+def upgrade():
+    op.create_table('favourite_count',
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('entity_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+    op.create_index('ix_favourite_count_top', 'favourite_count', ['kind', 'total', 'entity_id'], unique=False)
+    for kind, column in KINDS:
+        op.execute(
+            f"INSERT INTO favourite_count (kind, entity_id, total) "
+            f"SELECT '{kind}', {column}, COUNT(*) FROM favourites WHERE {column} IS NOT NULL GROUP BY {column}"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_favourite_count_top', table_name='favourite_count')
+    op.drop_table('favourite_count')
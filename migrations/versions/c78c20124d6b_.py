@@ -0,0 +1,77 @@
+"""numeric people height/weight and planets diameter/periods/surface water, with indexes
+
+Revision ID: c78c20124d6b
+Revises: 8d04fd478da3
+Create Date: 2026-10-17 18:59:58.336928
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c78c20124d6b'
+down_revision = '8d04fd478da3'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    ('people', 'height', sa.Integer()),
+    ('people', 'weight', sa.Float()),
+    ('planets', 'diameter', sa.Integer()),
+    ('planets', 'rotation_period', sa.Integer()),
+    ('planets', 'orbital_period', sa.Integer()),
+    ('planets', 'surface_water', sa.Float()),
+)
+# same as models.UNKNOWN
+UNKNOWN = {'', 'unknown', 'n/a', 'none'}
+
+
+def to_number(value, kind):
+    # like models.to_number, but what isn't a number becomes NULL instead of failing the migration
+    if value is None:
+        return None
+    value = str(value).strip().replace(',', '')
+    if value.lower() in UNKNOWN:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if number != number or number in (float('inf'), float('-inf')):
+        return None
+    return round(number) if isinstance(kind, sa.Integer) else number
+
+
+def to_text(value, kind):
+    if value is None:
+        return None
+    if isinstance(kind, sa.Float) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def convert(table, column, new_type, convert_value):
+    """Swaps the column for one of new_type holding the converted values (added, filled, dropped, renamed)"""
+    connection = op.get_bind()
+    op.add_column(table, sa.Column(f'{column}_new', new_type, nullable=True))
+    rows = [{'row_id': row_id, 'value': convert_value(value)}
+            for row_id, value in connection.execute(sa.text(f'SELECT id, {column} FROM {table}'))]
+    if rows:
+        connection.execute(sa.text(f'UPDATE {table} SET {column}_new = :value WHERE id = :row_id'), rows)
+    # plain statements, SQLite has them (3.35+) and alembic only emits them in batch mode there
+    op.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+    op.execute(f'ALTER TABLE {table} RENAME COLUMN {column}_new TO {column}')
+
+
+def upgrade():
+    for table, column, kind in COLUMNS:
+        convert(table, column, kind, lambda value: to_number(value, kind))
+        op.create_index(f'ix_{table}_{column}', table, [column], unique=False)
+
+
+def downgrade():
+    # the unknown values come back as NULL, not as "unknown"
+    for table, column, kind in reversed(COLUMNS):
+        op.drop_index(f'ix_{table}_{column}', table_name=table)
+        convert(table, column, sa.String(length=50), lambda value: to_text(value, kind))
@@ -0,0 +1,29 @@
+"""table_version, the per table write counter behind the ETags
+
+Revision ID: cee2712f85db
+Revises: fc7039645b5a
+Create Date: 2026-10-17 12:03:55.912480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cee2712f85db'
+down_revision = 'fc7039645b5a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [{'name': name, 'version': 1} for name in ('user', 'favourites', 'people', 'planets')])
+
+
+def downgrade():
+    op.drop_table('table_version')
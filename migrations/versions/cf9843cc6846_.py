@@ -0,0 +1,31 @@
+"""per user favourites snapshot
+
+Revision ID: cf9843cc6846
+Revises: def8665240c5
+Create Date: 2026-10-17 19:07:12.882379
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cf9843cc6846'
+down_revision = 'def8665240c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # starts empty, every snapshot is built by the first read of its user
+    op.create_table('favourites_snapshot',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('items', sa.JSON(none_as_null=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('favourites_snapshot')
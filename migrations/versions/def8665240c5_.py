@@ -0,0 +1,32 @@
+"""revoked tokens
+
+Revision ID: def8665240c5
+Revises: c78c20124d6b
+Create Date: 2026-10-17 19:03:41.578671
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'def8665240c5'
+down_revision = 'c78c20124d6b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revoked_token',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('jti', sa.String(length=36), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('jti')
+    )
+    op.create_index(op.f('ix_revoked_token_expires'), 'revoked_token', ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_token_expires'), table_name='revoked_token')
+    op.drop_table('revoked_token')
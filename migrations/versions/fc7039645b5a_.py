@@ -0,0 +1,37 @@
+"""favourites lookup indexes and one favourite per user and planet/person
+
+Revision ID: fc7039645b5a
+Revises: 6dac1c11ee9c
+Create Date: 2026-10-17 11:26:40.730561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fc7039645b5a'
+down_revision = '6dac1c11ee9c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the old duplicate check could let repeated favourites through, keep the oldest of each
+    op.execute(
+        "DELETE FROM favourites WHERE id NOT IN ("
+        "SELECT min(id) FROM favourites GROUP BY users_favourites_id, planet_favourites_id, people_favourites_id)"
+    )
+    op.create_index('ix_favourites_user', 'favourites', ['users_favourites_id'], unique=False)
+    op.create_index('ix_favourites_user_planet', 'favourites', ['users_favourites_id', 'planet_favourites_id'], unique=True,
+                    sqlite_where=sa.text('planet_favourites_id IS NOT NULL'),
+                    postgresql_where=sa.text('planet_favourites_id IS NOT NULL'))
+    op.create_index('ix_favourites_user_people', 'favourites', ['users_favourites_id', 'people_favourites_id'], unique=True,
+                    sqlite_where=sa.text('people_favourites_id IS NOT NULL'),
+                    postgresql_where=sa.text('people_favourites_id IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_favourites_user_people', table_name='favourites')
+    op.drop_index('ix_favourites_user_planet', table_name='favourites')
+    op.drop_index('ix_favourites_user', table_name='favourites')
@@ -1,7 +1,17 @@
 import os
 from flask_admin import Admin
-from models import db, User, Favourites, People, Planets
+from models import db, User, Favourites, People, Planets, Film, Starship, Vehicle, Species
 from flask_admin.contrib.sqla import ModelView
+from passwords import hash_password_sync, is_hashed
+
+
+class UserView(ModelView):
+    """The password field takes a new password and stores its hash, a hash left as it is stays"""
+
+    def on_model_change(self, form, model, is_created):
+        if model.password and not is_hashed(model.password):
+            model.password = hash_password_sync(model.password)
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -10,10 +20,12 @@ def setup_admin(app):
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(UserView(User, db.session))
     admin.add_view(ModelView(Favourites, db.session))
     admin.add_view(ModelView(People, db.session))
     admin.add_view(ModelView(Planets, db.session))
+    for entity in (Film, Starship, Vehicle, Species):
+        admin.add_view(ModelView(entity, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
@@ -2,19 +2,38 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+from flask import Flask, Response, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, paginate, wants_stream, stream_results, conditional, setup_json, requested_fields
 from admin import setup_admin
-from models import db, User, Favourites, People, Planets
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
+from database import setup_database, health
+from metrics import setup_metrics, render as render_metrics
+from cache import cache, cached, setup_cache
+from compression import setup_compression
+from auth import setup_auth
+from revocation import revocations
+from passwords import hash_password, verify_password, HasherBusy
+from ratelimit import rate_limited, setup_ratelimit
+from favourites import insert_favourite, favourite_conflict, remove_favourite, apply_batch, favourites_snapshot, expand_favourites, EXPANSIONS
+from bulk import request_records, import_people, import_planets
+from commands import setup_commands
+from search import search
+from stats import stats
+from popularity import popular
+from links import ENTITIES, ENTITY_PROJECTIONS, linked_to
+from models import db, User, Favourites, People, Planets, serializer_options, parse_measures, PEOPLE_PROJECTION, PLANETS_PROJECTION, USER_PROJECTION
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, get_jwt, get_jwt_identity, jwt_required, current_user
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+setup_json(app)
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -24,13 +43,22 @@ else:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 MIGRATE = Migrate(app, db)
-db.init_app(app)
+setup_database(app)
+setup_metrics(app)
 CORS(app)
 setup_admin(app)
+setup_cache(app)
+setup_compression(app)
+setup_commands(app)
 
-# Setup the Flask-JWT-Extended extension
-app.config["JWT_SECRET_KEY"] = "ligamento-peroneoastragalino-anterior"
-jwt = JWTManager(app)
+# Setup the Flask-JWT-Extended extension, keys and token lifetimes come from the environment (see auth.py)
+setup_auth(app)
+setup_ratelimit(app)
+
+def normalize_email(email):
+    if not isinstance(email, str):
+        raise APIException("email must be a string", status_code=400)
+    return email.strip().lower()
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -44,73 +72,121 @@ def sitemap():
 
 # route to let the user authenticate
 @app.route("/login", methods=["POST"])
+@rate_limited("login", by_email=True)
 def login():
     request_data = request.json
     needed_data = ["email", "password"]
     for item in needed_data:
         if item not in request_data:
             return jsonify({"msg": f"{item} is obligatory"}), 400
-    email = request_data.get("email", None)
+    if not isinstance(request_data.get("password"), str):
+        return jsonify({"msg": "password must be a string"}), 400
+    email = normalize_email(request_data.get("email", None))
     password = request_data.get("password", None)
-    try:
-        user = db.session.execute(db.select(User).filter_by(email=email)).scalar_one()
-    except:
+    user = db.session.execute(db.select(User).filter_by(email=email)).scalar_one_or_none()
+    if user is None:
         return jsonify({"error": "user not found"}), 404
-    if email != user.email or password != user.password:
+    try:
+        valid, new_hash = verify_password(password, user.password)
+    except HasherBusy:
+        return jsonify({"msg": "too many logins right now, please try again"}), 503, {"Retry-After": "1"}
+    if not valid:
         return jsonify({"msg": "Bad email or password"}), 401
-    access_token = create_access_token(identity=email)
+    # the hash was made with older cost parameters
+    if new_hash is not None:
+        user.password = new_hash
+        db.session.commit()
+    access_token = create_access_token(identity=user)
+    refresh_token = create_refresh_token(identity=user)
+    return jsonify(access_token=access_token, refresh_token=refresh_token)
+
+# a new access token for the refresh token of the Authorization header
+@app.route("/refresh", methods=["POST"])
+@jwt_required(refresh=True)
+def refresh():
+    access_token = create_access_token(identity=current_user)
     return jsonify(access_token=access_token)
 
+# revokes the token of the Authorization header, and the refresh token of the body if there is one
+@app.route("/logout", methods=["POST"])
+@jwt_required(verify_type=False)
+def logout():
+    tokens = [get_jwt()]
+    request_data = request.get_json(silent=True)
+    refresh_token = request_data.get("refresh_token") if isinstance(request_data, dict) else None
+    if refresh_token:
+        try:
+            refresh_data = decode_token(refresh_token)
+        except (PyJWTError, JWTExtendedException):
+            return jsonify({"msg": "invalid refresh token"}), 400
+        if refresh_data["sub"] != tokens[0]["sub"] or refresh_data["type"] != "refresh":
+            return jsonify({"msg": "invalid refresh token"}), 400
+        tokens.append(refresh_data)
+    revocations.revoke(tokens)
+    db.session.commit()
+    return jsonify({"msg": "logged out"}), 200
+
 
 # enpoints de user
 @app.route('/users', methods=['GET'])
 def get_users():
-    data = db.session.scalars(select(User)).all()
-    results = list(map(lambda item: item.serialize(), data))
+    fields = requested_fields(USER_PROJECTION.fields + ("favourites",))
+    if fields is not None and "favourites" not in fields:
+        stmt, serialize = USER_PROJECTION.select(fields), USER_PROJECTION.serializer(fields)
+    else:
+        # the favourites nest whole people and planets, they still go through the ORM
+        stmt = select(User).options(*serializer_options(User))
+        serialize = lambda users: [{key: value for key, value in item.serialize().items() if fields is None or key == "id" or key in fields} for item in users]
+    if wants_stream():
+        return stream_results(stmt, User, serialize, key="result")
+    results, next_cursor = paginate(stmt, User, serialize)
     if results == []:
         results = "there aren't any users in the database"
     response_body = {
-        "result": results
+        "result": results,
+        "next": next_cursor
     }
     return jsonify(response_body), 200
 
 @app.route('/signup', methods=['POST'])
+@rate_limited("signup")
 def add_user():
     request_data = request.json
-    email = request_data.get("email")
     required_fields = ["email", "password"]
     for item in required_fields:
         if item not in request_data:
             return jsonify({"error": f"required field {item} missing"})
+    if not isinstance(request_data.get("password"), str):
+        return jsonify({"error": "password must be a string"}), 400
+    email = normalize_email(request_data.get("email"))
+    if db.session.execute(db.select(User.id).filter_by(email=email)).first():
+        return ({"error": f"the user {email} already exists"}), 400
     try:
-        existing_user = db.session.execute(db.select(User).filter_by(email=email.lower())).scalar_one()
-        if existing_user:
-            return ({"error": f"the user {email} already exists"}), 400
-    except:
-        None
+        password = hash_password(request_data.get("password"))
+    except HasherBusy:
+        return jsonify({"msg": "too many signups right now, please try again"}), 503, {"Retry-After": "1"}
     new_user= User(
         email=email,
-        password=request_data.get("password")
+        password=password
     )
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return ({"error": f"the user {email} already exists"}), 400
     return jsonify({"results": new_user.serialize()}), 200
 
 # enpoints de favourites
 @app.route('/user/favorites', methods=['GET'])
 @jwt_required()
+@conditional("favourites", "people", "planets", vary=get_jwt_identity)
 def get_favourites():
-    current_user = get_jwt_identity()
-    try:
-        user = db.session.execute(db.select(User).filter_by(email=current_user)).scalar_one()
-    except:
-        return jsonify({"msg": "we got trouble getting the user, please try again later"}), 500
-    try:
-        favourites = db.session.scalars(db.select(Favourites).filter_by(users_favourites_id=user.id)).all()
-    except Exception as e:
-        print(f"Exception 111: {e}")
-        return jsonify({"msg": "something went wrong retrieving your data, if the problem persists please contact your administrator"}), 500
-    results = list(map(lambda favourite: favourite.serialize(), favourites))
+    # ?expand=people,planets for the whole entities instead of their id and name
+    expand = requested_fields(EXPANSIONS, parameter="expand")
+    results = favourites_snapshot(current_user.id)
+    if expand:
+        results = expand_favourites(results, expand)
     response_body = {
         "results": results
     }
@@ -120,81 +196,56 @@ def get_favourites():
 @app.route('/user/favorites/<int:favourite_id>', methods=['DELETE'])
 @jwt_required()
 def delete_favourite(favourite_id):
-    current_user=get_jwt_identity()
-    user = db.session.execute(db.select(User).filter_by(email=current_user)).scalar_one()
-    try:
-        favourites = db.session.execute(db.select(Favourites).filter_by(id=favourite_id, users_favourites_id=user.id)).scalar_one()
-    except:
-        return jsonify({"msg": "the favourite wasn't found"}), 404   
-    db.session.delete(favourites)
+    deleted = remove_favourite(current_user.id, favourite_id)
+    if deleted == 0:
+        return jsonify({"msg": "the favourite wasn't found"}), 404
     db.session.commit()
     return jsonify ({"msg": "favourite deleted"})
 
 
+# syncs many favourites at once, see favourites.apply_batch for the body
+@app.route('/user/favorites/batch', methods=['POST'])
+@jwt_required()
+def batch_favourites():
+    try:
+        results = apply_batch(current_user.id, request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"results": results}), 200
+
+
 @app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
 @jwt_required()
 def add_favourite_planet(planet_id):
-    current_user = get_jwt_identity()
-    request_data = request.json
-    try:
-        planet = db.session.execute(db.select(Planets).filter_by(id=planet_id)).scalar_one()
-    except NoResultFound:
-        return jsonify({"error": "planet not found."}), 404
-    try:
-        user = db.session.execute(db.select(User).filter_by(email=current_user)).scalar_one()
-    except NoResultFound:
-        return jsonify({"error": "user not found"}), 404
-    try:
-        favourite_exist = db.session.execute(db.select(Favourites).filter_by(users_favourites_id=user.id, planet_favourites_id=planet_id)).scalar_one()
-        if favourite_exist:
-            return jsonify({"msg": f"the user {user.email} already has the planet with id {planet_id} as a favourite"}), 400
-    except:
-        None
-    new_favourite = Favourites(
-        users_favourites = user,
-        planet_favourites = planet
-    )
-    db.session.add(new_favourite)
+    favourite_id = insert_favourite(current_user.id, "planet_favourites_id", planet_id)
+    if favourite_id is None:
+        if favourite_conflict("planet_favourites_id", planet_id) == "not found":
+            return jsonify({"error": "planet not found."}), 404
+        return jsonify({"msg": f"the user {current_user.email} already has the planet with id {planet_id} as a favourite"}), 400
+    new_favourite = db.session.execute(db.select(Favourites).filter_by(id=favourite_id).options(*serializer_options(Favourites))).scalar_one()
+    response_body = new_favourite.serialize()
     db.session.commit()
-    return jsonify(new_favourite.serialize()), 200
+    return jsonify(response_body), 200
 
 @app.route('/favorite/people/<int:people_id>', methods=['POST'])
 @jwt_required()
 def add_favourite_person(people_id):
-    current_user = get_jwt_identity()
-    request_data = request.json
-    try:
-        person = db.session.execute(db.select(People).filter_by(id=people_id)).scalar_one()
-    except NoResultFound:
-        return jsonify({"error": "person not found."}), 404
-    try:
-        user = db.session.execute(db.select(User).filter_by(email=current_user)).scalar_one()
-    except NoResultFound:
-        return jsonify({"error": "user not found"}), 404
-    try:
-        favourite_exist = db.session.execute(db.select(Favourites).filter_by(users_favourites_id=user.id, people_favourites_id=people_id)).scalar_one()
-        if favourite_exist:
-            return jsonify({"msg": f"the user {user.email} already has the person with id {people_id} as a favourite"}), 400
-    except:
-        None
-    new_favourite = Favourites(
-        users_favourites = user,
-        people_favourites = person
-    )
-    db.session.add(new_favourite)
+    favourite_id = insert_favourite(current_user.id, "people_favourites_id", people_id)
+    if favourite_id is None:
+        if favourite_conflict("people_favourites_id", people_id) == "not found":
+            return jsonify({"error": "person not found."}), 404
+        return jsonify({"msg": f"the user {current_user.email} already has the person with id {people_id} as a favourite"}), 400
+    new_favourite = db.session.execute(db.select(Favourites).filter_by(id=favourite_id).options(*serializer_options(Favourites))).scalar_one()
+    response_body = new_favourite.serialize()
     db.session.commit()
-    return jsonify(new_favourite.serialize()), 200
+    return jsonify(response_body), 200
 
 @app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 @jwt_required()
 def delete_favourite_planet(planet_id):
-    try:
-        planet = db.session.execute(db.select(Favourites).filter_by(id=planet_id)).scalar_one()
-    except NoResultFound:
+    deleted = remove_favourite(current_user.id, planet_id, "planet_favourites_id")
+    if deleted == 0:
         return jsonify({"error": "favourite planet not found"}), 404
-    if planet.serialize()["planets"] == None:
-        return jsonify({"error": "favourite planet not found"}), 404
-    db.session.delete(planet)
     db.session.commit()
     return jsonify({"msg": "favourite planet deleted"}), 200
 
@@ -202,36 +253,54 @@ def delete_favourite_planet(planet_id):
 @app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
 @jwt_required()
 def delete_favourite_character(people_id):
-    try:
-        person = db.session.execute(db.select(Favourites).filter_by(id=people_id)).scalar_one()
-    except NoResultFound:
+    deleted = remove_favourite(current_user.id, people_id, "people_favourites_id")
+    if deleted == 0:
         return jsonify({"error": "favourite person not found"}), 404
-    if person.serialize()["people"] == None:
-        return jsonify({"error": "favourite person not found"}), 404
-    db.session.delete(person)
     db.session.commit()
     return jsonify({"msg": "favourite person deleted"}), 200
 
 
 # enpoints de people
 @app.route('/people', methods=['GET'])
+@conditional("people", "planets")
+@cached("people", "planets")
 def get_people():
-    data = db.session.scalars(select(People)).all()
-    results = list(map(lambda person: person.serialize(), data))
+    fields = requested_fields(PEOPLE_PROJECTION.fields)
+    stmt, order = search(PEOPLE_PROJECTION.select(fields), People)
+    if wants_stream():
+        return stream_results(stmt, People, PEOPLE_PROJECTION.serializer(fields), order=order)
+    results, next_cursor = paginate(stmt, People, PEOPLE_PROJECTION.serializer(fields), order=order)
     response_body = {
-        "results": results
+        "results": results,
+        "next": next_cursor
     }
     return jsonify(response_body), 200
 
 
+# min/max/avg of the numeric columns by species (or ?by=), see stats.py
+@app.route('/people/stats', methods=['GET'])
+@conditional("people")
+@cached("people")
+def get_people_stats():
+    return jsonify({"results": stats(People)}), 200
+
+# the most favourited people, see popularity.py
+@app.route('/people/popular', methods=['GET'])
+@conditional("favourites", "people", "planets")
+def get_popular_people():
+    return jsonify({"results": popular(People)}), 200
+
+
 @app.route('/people/<int:people_id>', methods=['GET'])
+@conditional("people", "planets")
+@cached("people", "planets")
 def get_specific_users(people_id):
-    try:
-        person = db.session.execute(select(People).filter_by(id=people_id)).scalar_one()
-    except NoResultFound:
+    fields = requested_fields(PEOPLE_PROJECTION.fields)
+    rows = db.session.execute(PEOPLE_PROJECTION.select(fields).where(People.id == people_id)).all()
+    if not rows:
         return jsonify({"error": "Person not found."}), 404
     result_body = {
-        "result": person.serialize()
+        "result": PEOPLE_PROJECTION.serializer(fields)(rows)[0]
     }
     return jsonify(result_body), 200
 
@@ -242,11 +311,12 @@ def add_person():
     if "name" not in request_data:
         return jsonify({"error": "name field is obligatory"}), 400
     name = request_data.get("name")
-    data = db.session.scalars(select(People)).all()
-    results = list(map(lambda person: person.serialize(), data))
-    for person in results:
-        if person["name"].lower() == name.lower():
-            return jsonify({"error": f"{name} already exists"}), 400
+    try:
+        measures = parse_measures(request_data, People)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if db.session.execute(select(People.id).where(func.lower(People.name) == name.lower())).first():
+        return jsonify({"error": f"{name} already exists"}), 400
     homeworld = None
     if request_data.get("homeworld_id"):
         homeworld_id = request_data.get("homeworld_id")
@@ -260,8 +330,8 @@ def add_person():
         eye_color = request_data.get("eye_color"),
         gender = request_data.get("gender"),
         hair_color = request_data.get("hair_color"),
-        height = request_data.get("height"),
-        weight = request_data.get("weight"),
+        height = measures.get("height"),
+        weight = measures.get("weight"),
         skin_color = request_data.get("skin_color"),
         species = request_data.get("species"),
         starships = request_data.get("starships"),
@@ -273,27 +343,58 @@ def add_person():
         homeworld = homeworld
     )
     db.session.add(new_person)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # someone else created it between the lookup and the insert
+        db.session.rollback()
+        return jsonify({"error": f"{name} already exists"}), 400
     return jsonify({"results": new_person.serialize()}), 200
 
+@app.route('/people/bulk', methods=['POST'])
+def add_people_bulk():
+    # the records that fail are in the summary's errors, the others are saved
+    return jsonify(import_people(request_records())), 200
+
 # enpoints de planets
 @app.route('/planets', methods=['GET'])
+@conditional("planets", "people")
+@cached("planets", "people")
 def get_planets():
-    data = db.session.scalars(select(Planets)).all()
-    results = list(map(lambda planet: planet.serialize(), data))
+    fields = requested_fields(PLANETS_PROJECTION.fields)
+    stmt, order = search(PLANETS_PROJECTION.select(fields), Planets)
+    if wants_stream():
+        return stream_results(stmt, Planets, PLANETS_PROJECTION.serializer(fields), order=order)
+    results, next_cursor = paginate(stmt, Planets, PLANETS_PROJECTION.serializer(fields), order=order)
     result_body = {
-        "results": results
+        "results": results,
+        "next": next_cursor
     }
     return jsonify(result_body), 200
 
+# min/max/avg of the numeric columns by climate (or ?by=), see stats.py
+@app.route('/planets/stats', methods=['GET'])
+@conditional("planets")
+@cached("planets")
+def get_planets_stats():
+    return jsonify({"results": stats(Planets)}), 200
+
+# the most favourited planets, see popularity.py
+@app.route('/planets/popular', methods=['GET'])
+@conditional("favourites", "planets", "people")
+def get_popular_planets():
+    return jsonify({"results": popular(Planets)}), 200
+
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional("planets", "people")
+@cached("planets", "people")
 def get_specific_planet(planet_id):
-    try:
-        planet = db.session.execute(db.select(Planets).filter_by(id=planet_id)).scalar_one()
-    except NoResultFound:
+    fields = requested_fields(PLANETS_PROJECTION.fields)
+    rows = db.session.execute(PLANETS_PROJECTION.select(fields).where(Planets.id == planet_id)).all()
+    if not rows:
         return jsonify({"error": "Planet not found."}), 404
     response_body = {
-        "results": planet.serialize()
+        "results": PLANETS_PROJECTION.serializer(fields)(rows)[0]
     }
     return jsonify(response_body), 200
 
@@ -304,11 +405,12 @@ def add_planet():
     name = request_data.get("name")
     if "name" not in request_data:
         return jsonify({"error": "name field is obligatory"}), 400
-    data = db.session.scalars(select(Planets)).all()
-    results = list(map(lambda planet: planet.serialize(), data))
-    for planet in results:
-        if planet["name"].lower() == name.lower():
-            return jsonify({"error": f"{name} already exists"}), 400
+    try:
+        measures = parse_measures(request_data, Planets)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if db.session.execute(select(Planets.id).where(func.lower(Planets.name) == name.lower())).first():
+        return jsonify({"error": f"{name} already exists"}), 400
     residents = []
     if request_data.get("residents_id"):
         residents_id = request_data.get("residents_id")
@@ -320,23 +422,96 @@ def add_planet():
             return jsonify({"error": "person not found"}), 404
     new_planet = Planets(
         name = request_data.get("name"),
-        diameter = request_data.get("diameter"),
-        rotation_period = request_data.get("rotation_period"),
-        orbital_period = request_data.get("orbital_period"),
+        diameter = measures.get("diameter"),
+        rotation_period = measures.get("rotation_period"),
+        orbital_period = measures.get("orbital_period"),
         gravity = request_data.get("gravity"),
         population = request_data.get("population"),
         climate = request_data.get("climate"),
         terrain = request_data.get("terrain"),
-        surface_water = request_data.get("surface_water"),
+        surface_water = measures.get("surface_water"),
         image = request_data.get("image"),
         species = request_data.get("species"),
         films = request_data.get("films"),
         residents = residents
     )
     db.session.add(new_planet)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": f"{name} already exists"}), 400
     return jsonify({"results": new_planet.serialize()}), 200
 
+@app.route('/planets/bulk', methods=['POST'])
+def add_planets_bulk():
+    # the records that fail are in the summary's errors, the others are saved
+    return jsonify(import_planets(request_records())), 200
+
+# films, starships, vehicles and species, see links.py
+@app.route('/<any(films, starships, vehicles, species):kind>', methods=['GET'])
+@conditional("films", "starships", "vehicles", "species")
+def get_entities(kind):
+    projection = ENTITY_PROJECTIONS[kind]
+    results, next_cursor = paginate(projection.select(), ENTITIES[kind], projection.serializer())
+    response_body = {
+        "results": results,
+        "next": next_cursor
+    }
+    return jsonify(response_body), 200
+
+@app.route('/<any(films, starships, vehicles, species):kind>/<int:entity_id>', methods=['GET'])
+@conditional("films", "starships", "vehicles", "species")
+def get_specific_entity(kind, entity_id):
+    projection = ENTITY_PROJECTIONS[kind]
+    rows = db.session.execute(projection.select().where(ENTITIES[kind].id == entity_id)).all()
+    if not rows:
+        return jsonify({"error": f"{kind} {entity_id} not found."}), 404
+    return jsonify({"result": projection.serializer()(rows)[0]}), 200
+
+def linked_results(kind, entity_id, model, projection):
+    """The people/planets linked to one film, starship..., paginated or streamed like GET /people"""
+    entity = ENTITIES[kind]
+    if db.session.execute(select(entity.id).where(entity.id == entity_id)).first() is None:
+        return jsonify({"error": f"{kind} {entity_id} not found."}), 404
+    fields = requested_fields(projection.fields)
+    stmt, order = search(linked_to(projection.select(fields), model, kind, entity_id), model)
+    if wants_stream():
+        return stream_results(stmt, model, projection.serializer(fields), order=order)
+    results, next_cursor = paginate(stmt, model, projection.serializer(fields), order=order)
+    response_body = {
+        "results": results,
+        "next": next_cursor
+    }
+    return jsonify(response_body), 200
+
+@app.route('/<any(films, starships, vehicles, species):kind>/<int:entity_id>/people', methods=['GET'])
+@conditional("people", "planets")
+@cached("people", "planets")
+def get_entity_people(kind, entity_id):
+    return linked_results(kind, entity_id, People, PEOPLE_PROJECTION)
+
+@app.route('/<any(films, species):kind>/<int:entity_id>/planets', methods=['GET'])
+@conditional("planets", "people")
+@cached("planets", "people")
+def get_entity_planets(kind, entity_id):
+    return linked_results(kind, entity_id, Planets, PLANETS_PROJECTION)
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
+# database reachability and pool usage, see database.py
+@app.route('/health', methods=['GET'])
+def get_health():
+    body, status = health()
+    return jsonify(body), status
+
+# request histograms in the Prometheus text format, see metrics.py
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
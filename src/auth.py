@@ -0,0 +1,136 @@
+"""
+JWT identity: tokens carry the user id as subject and the email as a claim. The endpoints read the
+user through flask_jwt_extended.current_user, resolved from a small TTL cache so an authenticated
+request doesn't pay a user lookup on top of its own queries. Every worker has its own cache and a
+commit only clears it in the worker that made it: the others keep serving a changed or deleted user
+for up to AUTH_USER_CACHE_TTL seconds (5, like the revocations of the other workers, see
+revocation.py), a deleted account's token works that long.
+
+/login hands out a short lived access token and a refresh token for /refresh, /logout revokes them
+(revocation.py). Tokens are signed with the first key of the keyring and carry its id in the "kid"
+header, the other keys still verify the tokens they signed, so a key is rotated by putting the new
+one first and dropping the old one once its tokens expired:
+
+    JWT_KEYS=2026-10:new-secret,2026-04:old-secret
+    JWT_ACCESS_MINUTES=15
+    JWT_REFRESH_DAYS=30
+
+Without JWT_KEYS, JWT_SECRET_KEY is the only key ("default"), it also verifies the tokens without kid.
+"""
+import os
+from collections import namedtuple
+from datetime import timedelta
+from itertools import chain
+from flask_jwt_extended import JWTManager
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from cache import LocalCache
+from models import db, User
+from revocation import revocations, DEFAULT_CAPACITY, DEFAULT_SYNC_SECONDS
+
+CurrentUser = namedtuple("CurrentUser", ["id", "email"])
+
+jwt = JWTManager()
+users = LocalCache(
+    max_entries=int(os.getenv("AUTH_USER_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("AUTH_USER_CACHE_TTL", DEFAULT_SYNC_SECONDS))
+)
+# only for development, deployments set JWT_KEYS or JWT_SECRET_KEY
+DEVELOPMENT_KEY = "ligamento-peroneoastragalino-anterior"
+# key id -> secret, the first one signs
+keyring = {}
+
+
+def parse_keyring(value):
+    """"2026-10:secret,2026-04:older" -> {"2026-10": "secret", "2026-04": "older"}"""
+    keys = {}
+    for entry in value.split(","):
+        kid, separator, secret = entry.strip().partition(":")
+        if not separator or not kid or not secret:
+            raise ValueError(f"JWT_KEYS entries are kid:secret, got {entry.strip()!r}")
+        keys[kid] = secret
+    return keys
+
+def signing_kid():
+    return next(iter(keyring))
+
+
+@jwt.encode_key_loader
+def encode_key(identity):
+    return keyring[signing_kid()]
+
+@jwt.additional_headers_loader
+def key_id_header(identity):
+    return {"kid": signing_kid()}
+
+@jwt.decode_key_loader
+def decode_key(jwt_header, jwt_data):
+    kid = jwt_header.get("kid", "default")
+    if kid not in keyring:
+        raise InvalidTokenError(f"unknown key id {kid}")
+    return keyring[kid]
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_data):
+    return revocations.is_revoked(jwt_data["jti"])
+
+
+# create_access_token(identity=user)
+@jwt.user_identity_loader
+def user_identity(user):
+    return str(user.id)
+
+@jwt.additional_claims_loader
+def user_claims(user):
+    return {"email": user.email}
+
+@jwt.user_lookup_loader
+def load_user(jwt_header, jwt_data):
+    try:
+        user_id = int(jwt_data["sub"])
+    except ValueError:
+        # tokens issued with the email as identity, their owner has to log in again
+        return None
+    user = users.get(user_id)
+    if user is None:
+        row = db.session.execute(select(User.id, User.email).filter_by(id=user_id)).first()
+        if row is None:
+            return None
+        user = CurrentUser(row.id, row.email)
+        users.set(user_id, user)
+    return user
+
+
+# forget the users changed or deleted in a transaction once it commits, in this worker only
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("changed_users", set())
+    changed.update(instance.id for instance in chain(session.dirty, session.deleted) if isinstance(instance, User))
+
+@event.listens_for(Session, "after_commit")
+def forget_changed_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        users.delete(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session):
+    session.info.pop("changed_users", None)
+
+
+def setup_auth(app):
+    keyring.clear()
+    if os.getenv("JWT_KEYS"):
+        keyring.update(parse_keyring(os.environ["JWT_KEYS"]))
+    else:
+        if not os.getenv("JWT_SECRET_KEY"):
+            app.logger.warning("neither JWT_KEYS nor JWT_SECRET_KEY is set, tokens are signed with the development key")
+        keyring["default"] = os.getenv("JWT_SECRET_KEY", DEVELOPMENT_KEY)
+    app.config["JWT_SECRET_KEY"] = keyring[signing_kid()]
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=int(os.getenv("JWT_ACCESS_MINUTES", 15)))
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=int(os.getenv("JWT_REFRESH_DAYS", 30)))
+    revocations.configure(
+        capacity=int(os.getenv("REVOCATION_CAPACITY", DEFAULT_CAPACITY)),
+        sync_seconds=float(os.getenv("REVOCATION_SYNC_SECONDS", DEFAULT_SYNC_SECONDS))
+    )
+    jwt.init_app(app)
@@ -0,0 +1,212 @@
+"""
+Bulk import of people and planets, used by POST /people/bulk, POST /planets/bulk and the
+`flask import-people` / `flask import-planets` commands.
+Records are handled in batches: one query per batch to find the names that already exist, one to
+check the referenced ids, one executemany INSERT and one commit, whatever the batch size.
+The films/starships/vehicles/species of the new rows are linked by links.sync_links, a few more
+queries per batch.
+Every batch is committed on its own, so a bad record (or a NDJSON line that isn't JSON) never fails
+the import: it is reported in the summary's errors by its index and the others are saved.
+"""
+import json
+from itertools import islice
+from sqlalchemy import select, func, insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from flask import request
+from models import db, People, Planets, parse_measures
+from links import sync_links
+from utils import APIException
+
+BATCH_SIZE = 1000
+
+PEOPLE_FIELDS = ("name", "birth_year", "eye_color", "gender", "hair_color", "height", "weight", "skin_color", "species",
+                 "starships", "vehicles", "master", "disciple", "image", "films", "homeworld_id")
+PLANETS_FIELDS = ("name", "diameter", "rotation_period", "orbital_period", "gravity", "population", "climate", "terrain",
+                  "surface_water", "image", "species", "films")
+
+
+class InvalidLine:
+    """A NDJSON line that couldn't be decoded, _validate reports it in place of its record"""
+
+    def __init__(self, number, error):
+        self.number = number
+        self.error = error
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode()
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+        except ValueError as e:
+            yield InvalidLine(number, str(e))
+
+def read_records(stream, ndjson):
+    """Records from a file-like object, NDJSON is read line by line so the file never sits in memory"""
+    if ndjson:
+        return read_ndjson(stream)
+    records = json.load(stream)
+    if not isinstance(records, list):
+        raise ValueError("expected a JSON list of records")
+    return iter(records)
+
+def request_records():
+    """Records sent to a bulk endpoint: a JSON list, or NDJSON (application/x-ndjson) read as it arrives"""
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        return read_ndjson(request.stream)
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise APIException("expected a JSON list of records or an application/x-ndjson body", status_code=400)
+    return iter(records)
+
+def batches(records, size):
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _existing_names(model, names):
+    if not names:
+        return set()
+    return set(db.session.scalars(select(func.lower(model.name)).where(func.lower(model.name).in_(names))))
+
+def _existing_ids(model, ids):
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+def _ids_by_name(model, rows):
+    names = [row["name"].lower() for row in rows]
+    return dict(db.session.execute(select(func.lower(model.name), model.id).where(func.lower(model.name).in_(names))).all())
+
+def _link(model, rows):
+    """Links the rows just inserted to their films, starships..., returns their ids by lowercased name"""
+    ids = _ids_by_name(model, rows)
+    sync_links(db.session.connection(), model, {ids[row["name"].lower()]: row for row in rows}, replace=False)
+    return ids
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _validate(batch, offset, model, summary):
+    """Drops the invalid and duplicated records of the batch, returns the good ones as (index, record)"""
+    candidates = []
+    seen = set()
+    for index, record in enumerate(batch, start=offset):
+        if isinstance(record, InvalidLine):
+            summary["errors"].append({"index": index, "line": record.number, "error": f"invalid JSON: {record.error}"})
+            continue
+        if not isinstance(record, dict):
+            summary["errors"].append({"index": index, "error": "record must be an object"})
+            continue
+        name = record.get("name")
+        if not isinstance(name, str) or not name.strip():
+            summary["errors"].append({"index": index, "error": "name field is obligatory"})
+            continue
+        try:
+            measures = parse_measures(record, model)
+        except ValueError as e:
+            summary["errors"].append({"index": index, "error": str(e)})
+            continue
+        if model is People and record.get("homeworld_id") is not None and not _is_id(record["homeworld_id"]):
+            summary["errors"].append({"index": index, "error": "homeworld_id must be an integer"})
+            continue
+        residents = record.get("residents_id") if model is Planets else None
+        if residents is not None and not (isinstance(residents, list) and all(_is_id(person_id) for person_id in residents)):
+            summary["errors"].append({"index": index, "error": "residents_id must be a list of integers"})
+            continue
+        if name.lower() in seen:
+            summary["skipped"].append({"index": index, "name": name, "reason": "duplicated in the import"})
+            continue
+        seen.add(name.lower())
+        candidates.append((index, {**record, **measures}))
+    existing = _existing_names(model, seen)
+    valid = []
+    for index, record in candidates:
+        if record["name"].lower() in existing:
+            summary["skipped"].append({"index": index, "name": record["name"], "reason": "already exists"})
+        else:
+            valid.append((index, record))
+    return valid
+
+
+def _insert_people(valid, summary):
+    planets = _existing_ids(Planets, {record["homeworld_id"] for _, record in valid if record.get("homeworld_id") is not None})
+    rows = []
+    for index, record in valid:
+        homeworld_id = record.get("homeworld_id")
+        if homeworld_id is not None and homeworld_id not in planets:
+            summary["errors"].append({"index": index, "error": f"planet {homeworld_id} not found"})
+            continue
+        rows.append({field: record.get(field) for field in PEOPLE_FIELDS})
+    if not rows:
+        return 0
+    db.session.execute(insert(People.__table__), rows)
+    _link(People, rows)
+    return len(rows)
+
+def _insert_planets(valid, summary):
+    referenced = set()
+    for index, record in valid:
+        referenced.update(record.get("residents_id") or [])
+    known_people = _existing_ids(People, referenced)
+    rows = []
+    residents_by_name = {}
+    for index, record in valid:
+        residents = record.get("residents_id") or []
+        missing = [person_id for person_id in residents if person_id not in known_people]
+        if missing:
+            summary["errors"].append({"index": index, "error": f"people {missing} not found"})
+            continue
+        rows.append({field: record.get(field) for field in PLANETS_FIELDS})
+        if residents:
+            residents_by_name[record["name"].lower()] = residents
+    if not rows:
+        return 0
+    db.session.execute(insert(Planets.__table__), rows)
+    planet_ids = _link(Planets, rows)
+    if residents_by_name:
+        # the residents move to the new planets
+        moves = [{"person_id": person_id, "planet_id": planet_ids[name]}
+                 for name, residents in residents_by_name.items() for person_id in residents]
+        people = People.__table__
+        db.session.execute(
+            update(people).where(people.c.id == bindparam("person_id")).values(homeworld_id=bindparam("planet_id")),
+            moves
+        )
+    return len(rows)
+
+
+def _import(records, model, insert_batch, batch_size):
+    summary = {"inserted": 0, "skipped": [], "errors": []}
+    offset = 0
+    for batch in batches(records, batch_size):
+        # a concurrent writer can take a name between the check and the insert, the second
+        # attempt sees it and skips that record instead of failing the whole batch
+        for attempt in range(2):
+            attempt_summary = {"skipped": [], "errors": []}
+            valid = _validate(batch, offset, model, attempt_summary)
+            try:
+                inserted = insert_batch(valid, attempt_summary)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == 1:
+                    raise
+        offset += len(batch)
+        summary["inserted"] += inserted
+        summary["skipped"] += attempt_summary["skipped"]
+        summary["errors"] += attempt_summary["errors"]
+    return summary
+
+def import_people(records, batch_size=BATCH_SIZE):
+    return _import(records, People, _insert_people, batch_size)
+
+def import_planets(records, batch_size=BATCH_SIZE):
+    return _import(records, Planets, _insert_planets, batch_size)
@@ -0,0 +1,179 @@
+"""
+Read-through cache for the catalogue responses (/people, /planets and their details).
+CACHE_URL picks the backend: "local" (default) keeps an LRU with TTL inside every worker,
+memory:// or redis://... share the entries between workers through store.py.
+Every cached response is keyed by the versions of the tables it is made of (the same
+table_version rows its ETag comes from, see utils.conditional) and its path: any write to
+those tables, by any worker or the admin, bumps a version and the next read misses. The
+entries left behind are never read again and go with the LRU or the TTL. Every entry can have
+compressed variants (compression.py) stored next to it under the same key.
+A hit still costs one query, the primary key read of those table_version rows (shared with the
+ETag, so a 304 costs the same): it saves the page query and the serialization, not the round trip.
+Keeping the versions outside the database would let a hit or an ETag outlive a write for as long
+as they are kept.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app, Response
+import store
+from compression import compression, encoded
+from utils import request_table_versions
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 512
+
+
+class LocalCache:
+    """In-process LRU with TTL"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCache:
+    """Entries kept in a redis-like store so every worker shares them"""
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix="cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        # the store evicts on its own, it doesn't tell us about it
+        self.evictions = 0
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        self.client.flushdb()
+
+    def __len__(self):
+        return 0
+
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LocalCache()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, url="local", ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        if url == "local":
+            self.backend = LocalCache(max_entries=max_entries, ttl=ttl)
+        else:
+            self.backend = SharedCache(store.connect(url), ttl=ttl)
+
+    def key(self, tables):
+        versions = ".".join(str(version) for version in request_table_versions(tables))
+        return f"{versions}:{request.full_path}"
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "entries": len(self.backend)
+        }
+
+
+cache = ResponseCache()
+
+
+def with_variant(response, key, encoding):
+    """
+    Sends response compressed with encoding, the compressed body is kept in the cache next to
+    the plain one (key:encoding) so it is only compressed once.
+    """
+    body = response.get_data()
+    if encoding is None or len(body) < compression.min_size:
+        return response
+    variant = cache.backend.get(f"{key}:{encoding}")
+    if variant is None:
+        variant = compression.compress(body, encoding, cached=True)
+        cache.backend.set(f"{key}:{encoding}", variant)
+    return encoded(response, encoding, variant)
+
+
+def cached(*tables):
+    """
+    Caches the successful JSON responses of a GET view made of the tables, e.g.
+    @cached("people", "planets"), the same tables as its @conditional. Streamed responses are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or request.args.get("stream") is not None:
+                return view(*args, **kwargs)
+            key = cache.key(tables)
+            encoding = compression.negotiate()
+            # the variant alone is enough to answer, one lookup for the usual hit
+            variant = cache.backend.get(f"{key}:{encoding}") if encoding is not None else None
+            if variant is not None:
+                cache.hits += 1
+                response = encoded(Response(variant, mimetype="application/json"), encoding)
+                response.headers["X-Cache"] = "HIT"
+                return response
+            body = cache.backend.get(key)
+            if body is not None:
+                cache.hits += 1
+                response = with_variant(Response(body, mimetype="application/json"), key, encoding)
+                response.headers["X-Cache"] = "HIT"
+                return response
+            cache.misses += 1
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.backend.set(key, response.get_data())
+                response = with_variant(response, key, encoding)
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+def setup_cache(app):
+    cache.configure(
+        url=os.getenv("CACHE_URL", "local"),
+        ttl=int(os.getenv("CACHE_TTL", DEFAULT_TTL)),
+        max_entries=int(os.getenv("CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    )
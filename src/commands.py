@@ -0,0 +1,51 @@
+"""
+Flask commands, run them with `flask <command>` (FLASK_APP=src/app.py)
+"""
+import json
+import sys
+import click
+from bulk import read_records, import_people, import_planets, BATCH_SIZE
+from favourites import reconcile_counts
+from models import db
+from revocation import revocations
+
+
+def setup_commands(app):
+
+    def run_import(importer, path, batch_size):
+        # .ndjson/.jsonl files and stdin are read one line at a time, .json files hold a list
+        ndjson = path == "-" or path.endswith((".ndjson", ".jsonl"))
+        stream = sys.stdin if path == "-" else open(path)
+        with stream:
+            summary = importer(read_records(stream, ndjson), batch_size=batch_size)
+        click.echo(f"{summary['inserted']} inserted, {len(summary['skipped'])} skipped, {len(summary['errors'])} errors")
+        for error in summary["errors"]:
+            click.echo(json.dumps(error), err=True)
+
+    # flask import-people people.ndjson
+    @app.cli.command("import-people")
+    @click.argument("path")
+    @click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+    def import_people_command(path, batch_size):
+        run_import(import_people, path, batch_size)
+
+    # flask import-planets planets.json
+    @app.cli.command("import-planets")
+    @click.argument("path")
+    @click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+    def import_planets_command(path, batch_size):
+        run_import(import_planets, path, batch_size)
+
+    # flask prune-revoked-tokens, run it now and then (cron, render cron job)
+    @app.cli.command("prune-revoked-tokens")
+    def prune_revoked_tokens_command():
+        deleted = revocations.prune()
+        db.session.commit()
+        click.echo(f"{deleted} expired revoked tokens deleted")
+
+    # flask reconcile-favourite-counts, run it now and then like prune-revoked-tokens
+    @app.cli.command("reconcile-favourite-counts")
+    def reconcile_favourite_counts_command():
+        fixed = reconcile_counts()
+        db.session.commit()
+        click.echo(f"{fixed} favourite counts fixed")
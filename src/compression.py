@@ -0,0 +1,114 @@
+"""
+gzip / Brotli compression of the responses, negotiated with Accept-Encoding.
+Bodies under COMPRESS_MIN_SIZE bytes go out as they are, streamed responses are compressed
+chunk by chunk and flushed after each one so the client still gets the rows as they come.
+The cached responses (cache.py) keep their compressed variants next to the plain body, a hot
+response is compressed once and served from the cache afterwards.
+COMPRESS_ENCODINGS picks the encodings in order of preference (br,gzip by default, br needs
+the optional brotli package).
+"""
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # optional, `pipenv install brotli` to use it, gzip only without it
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+COMPRESSIBLE = {"application/json", "application/x-ndjson", "text/html", "text/plain", "text/css", "application/javascript"}
+# on the fly compression must be cheap, the cached variants are made once and can take longer
+LEVELS = {
+    "gzip": {"fast": 6, "cached": 9},
+    "br": {"fast": 5, "cached": 9},
+}
+
+
+class Compression:
+    def __init__(self):
+        self.encodings = ("gzip",)
+        self.min_size = DEFAULT_MIN_SIZE
+
+    def configure(self, encodings="br,gzip", min_size=DEFAULT_MIN_SIZE):
+        wanted = [encoding.strip() for encoding in encodings.split(",") if encoding.strip()]
+        unknown = set(wanted) - set(LEVELS)
+        if unknown:
+            raise RuntimeError(f"unsupported COMPRESS_ENCODINGS {', '.join(sorted(unknown))}")
+        self.encodings = tuple(encoding for encoding in wanted if encoding != "br" or brotli is not None)
+        self.min_size = min_size
+
+    def negotiate(self):
+        """The encoding to send this request's response with, None for identity"""
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = request.accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data, encoding, cached=False):
+        level = LEVELS[encoding]["cached" if cached else "fast"]
+        if encoding == "br":
+            return brotli.compress(data, quality=level)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=LEVELS["br"]["fast"])
+            for chunk in chunks:
+                yield compressor.process(chunk.encode() if isinstance(chunk, str) else chunk) + compressor.flush()
+            yield compressor.finish()
+            return
+        compressor = zlib.compressobj(LEVELS["gzip"]["fast"], zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+compression = Compression()
+
+
+def compressible(response):
+    return response.mimetype in COMPRESSIBLE and not response.direct_passthrough
+
+
+def encoded(response, encoding, body=None):
+    """Marks response as its encoding variant, body being the already compressed data (None for streams)"""
+    if body is not None:
+        response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None:
+        # each variant is a different representation, it needs its own strong ETag
+        response.set_etag(f"{etag}+{encoding}", weak)
+    return response
+
+
+def compress_response(response):
+    if not compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    encoding = compression.negotiate()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compression.compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+        return encoded(response, encoding)
+    body = response.get_data()
+    if len(body) < compression.min_size:
+        return response
+    return encoded(response, encoding, compression.compress(body, encoding))
+
+
+def setup_compression(app):
+    compression.configure(
+        encodings=os.getenv("COMPRESS_ENCODINGS", "br,gzip"),
+        min_size=int(os.getenv("COMPRESS_MIN_SIZE", DEFAULT_MIN_SIZE))
+    )
+    app.after_request(compress_response)
@@ -0,0 +1,104 @@
+"""
+Engine and connection pool settings, all of them from the environment:
+
+    DB_POOL_SIZE=5            connections kept open per worker
+    DB_MAX_OVERFLOW=10        extra connections opened under load and closed afterwards
+    DB_POOL_TIMEOUT=30        seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE=1800      seconds after which a connection is replaced (servers and proxies drop idle ones)
+    DB_POOL_PRE_PING=1        checks every connection when it leaves the pool, stale ones are replaced
+    DB_STATEMENT_TIMEOUT=0    milliseconds before Postgres cancels a query, 0 for no limit
+
+Every gunicorn worker has its own pool, workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay
+under the server max_connections. GET /health shows how much of the pool is in use.
+The local SQLite database runs in WAL mode so readers don't wait for the writer.
+"""
+import os
+import time
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from models import db
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # safe with WAL, only the last transactions can be lost on a power failure, never corrupted
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+# the dialects whose insert() has ON CONFLICT DO NOTHING/UPDATE
+UPSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+def engine_options(url):
+    url = make_url(url)
+    options = {"pool_pre_ping": flag("DB_POOL_PRE_PING", "1")}
+    if url.get_backend_name() == "sqlite":
+        return options
+    options.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    )
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))
+    if statement_timeout and url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def upsert_for(bind):
+    """The insert() with ON CONFLICT of the bind's dialect (an engine or connection), None when it has none"""
+    return UPSERT_DIALECTS.get(bind.dialect.name)
+
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def pool_status():
+    pool = db.engine.pool
+    status = {"class": type(pool).__name__}
+    # only the queue pools (everything but in-memory SQLite) keep these counters
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    max_overflow = current_app.config["SQLALCHEMY_ENGINE_OPTIONS"].get("max_overflow")
+    if "size" in status and max_overflow is not None:
+        status["max_overflow"] = max_overflow
+        # -1 means no overflow limit, the share of the base pool is all there is to show then
+        status["utilisation"] = round(status["checkedout"] / (status["size"] + max(max_overflow, 0)), 3)
+    return status
+
+
+def health():
+    """(body, status code) for GET /health"""
+    start = time.perf_counter()
+    try:
+        db.session.execute(text("SELECT 1"))
+    except Exception as e:
+        db.session.rollback()
+        return {"status": "unavailable", "database": {"ok": False, "error": str(e)}, "pool": pool_status()}, 503
+    latency = (time.perf_counter() - start) * 1000
+    return {"status": "ok", "database": {"ok": True, "latency_ms": round(latency, 2)}, "pool": pool_status()}, 200
+
+
+def setup_database(app):
+    url = app.config["SQLALCHEMY_DATABASE_URI"]
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(url))
+    db.init_app(app)
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:"):
+        with app.app_context():
+            event.listen(db.engine, "connect", sqlite_pragmas)
@@ -0,0 +1,398 @@
+"""
+Writes on the favourites table, shared by the favourite endpoints.
+Every write also updates the user's snapshot (FavouritesSnapshot), the list GET /user/favorites
+answers with in one primary key read: favourite ids with the id and name of their person/planet,
+the whole entities only come with ?expand=. A snapshot is built from the favourites table by the
+first read after it was dropped or never existed, the admin's edits drop them (and so does
+renaming or deleting a person/planet through the ORM).
+The writes also keep FavouriteCount, how many users have each person/planet, in the same
+transaction (GET /people/popular and /planets/popular), `flask reconcile-favourite-counts`
+fixes the counts that drifted anyway.
+"""
+from itertools import chain
+from collections import Counter
+from sqlalchemy import select, literal, insert, update, delete, or_, func, event, inspect
+from sqlalchemy.exc import IntegrityError, DBAPIError
+from sqlalchemy.orm import Session, aliased
+from models import db, Favourites, FavouritesSnapshot, FavouriteCount, People, Planets, PEOPLE_PROJECTION, PLANETS_PROJECTION, bump_table_versions
+from database import upsert_for
+from utils import APIException
+
+# favourite column -> table it points to
+TARGETS = {
+    "planet_favourites_id": Planets,
+    "people_favourites_id": People,
+}
+# name used by the batch endpoint -> favourite column
+KINDS = {
+    "planets": "planet_favourites_id",
+    "people": "people_favourites_id",
+}
+COLUMN_KINDS = {column: kind for kind, column in KINDS.items()}
+# ids of one batch, all of them go in one IN and its snapshot row stays locked until the batch is done
+MAX_BATCH_SIZE = 500
+# ?expand= of GET /user/favorites -> the full entities
+EXPANSIONS = {
+    "people": PEOPLE_PROJECTION,
+    "planets": PLANETS_PROJECTION,
+}
+
+
+def snapshot_items(user_id, favourite_ids=None):
+    """Snapshot items of the favourites of the user (only favourite_ids when given), in one query"""
+    table = Favourites.__table__
+    person, planet = aliased(People), aliased(Planets)
+    stmt = (select(table.c.id, person.id, person.name, planet.id, planet.name)
+            .outerjoin(person, person.id == table.c.people_favourites_id)
+            .outerjoin(planet, planet.id == table.c.planet_favourites_id)
+            .where(table.c.users_favourites_id == user_id)
+            .order_by(table.c.id))
+    if favourite_ids is not None:
+        stmt = stmt.where(table.c.id.in_(favourite_ids))
+    return [
+        {
+            "id": favourite_id,
+            "people": {"id": person_id, "name": person_name} if person_id is not None else None,
+            "planets": {"id": planet_id, "name": planet_name} if planet_id is not None else None
+        }
+        for favourite_id, person_id, person_name, planet_id, planet_name in db.session.execute(stmt)
+    ]
+
+def update_snapshot(user_id, added=(), removed=()):
+    """Applies a write of favourites (the favourite ids added and removed) to the user's snapshot, in the same transaction"""
+    table = FavouritesSnapshot.__table__
+    # concurrent writes of the same user take turns, each one applies its change to the other's
+    row = db.session.execute(select(FavouritesSnapshot.items).where(table.c.user_id == user_id).with_for_update()).first()
+    if row is None:
+        # nothing to update, the next read builds it. The version still has to change: a read
+        # building it right now from the favourites before this write must not store its items
+        upsert = upsert_for(db.session.get_bind())
+        if upsert is not None:
+            stmt = upsert(table).values(user_id=user_id, version=1, items=None).on_conflict_do_update(
+                index_elements=["user_id"], set_={"version": table.c.version + 1, "items": None}
+            )
+            db.session.execute(stmt)
+        return
+    items = row.items
+    if items is not None:
+        gone = set(removed)
+        items = [item for item in items if item["id"] not in gone]
+        # a concurrent request may have added (and snapshotted) the same favourite
+        added = set(added) - {item["id"] for item in items}
+        if added:
+            items += snapshot_items(user_id, added)
+    db.session.execute(update(table).where(table.c.user_id == user_id).values(items=items, version=table.c.version + 1))
+
+def favourites_snapshot(user_id):
+    """The snapshot items of the user, built and stored when there are none"""
+    table = FavouritesSnapshot.__table__
+    row = db.session.execute(select(FavouritesSnapshot.version, FavouritesSnapshot.items).where(table.c.user_id == user_id)).first()
+    if row is not None and row.items is not None:
+        return row.items
+    items = snapshot_items(user_id)
+    if row is None:
+        upsert = upsert_for(db.session.get_bind())
+        stmt = insert(table) if upsert is None else upsert(table).on_conflict_do_nothing(index_elements=["user_id"])
+        stmt = stmt.values(user_id=user_id, version=0, items=items)
+    else:
+        # only if no write happened since the version was read
+        stmt = update(table).where(table.c.user_id == user_id, table.c.version == row.version).values(items=items)
+    try:
+        db.session.execute(stmt)
+        db.session.commit()
+    except (IntegrityError, DBAPIError):
+        # a write got there first, it is stored on the next read
+        db.session.rollback()
+    return items
+
+def expand_favourites(items, kinds):
+    """Replaces the {"id", "name"} of the kinds ("people", "planets") by the whole entities, one query per kind"""
+    items = [dict(item) for item in items]
+    for kind in kinds:
+        projection = EXPANSIONS[kind]
+        ids = {item[kind]["id"] for item in items if item[kind] is not None}
+        if not ids:
+            continue
+        rows = db.session.execute(projection.select().where(projection.model.id.in_(ids))).all()
+        entities = {entity["id"]: entity for entity in projection.serializer()(rows)}
+        for item in items:
+            if item[kind] is not None:
+                item[kind] = entities.get(item[kind]["id"])
+    return items
+
+# favourites written through the unit of work (the admin), and people/planets renamed or deleted
+# there: the snapshots of their users are built again
+@event.listens_for(Session, "after_flush")
+def drop_flushed_snapshots(session, flush_context):
+    users = set()
+    # favourite column -> ids of the people/planets whose {"id", "name"} changed
+    entities = {column: set() for column in TARGETS}
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Favourites):
+            # the favourite may also have moved from another user
+            history = inspect(instance).attrs.users_favourites_id.history
+            users.update(user_id for user_id in chain(history.sum(), [instance.users_favourites_id]) if user_id is not None)
+        elif isinstance(instance, (People, Planets)) and instance not in session.new:
+            if instance in session.deleted or inspect(instance).attrs.name.history.has_changes():
+                column = next(column for column, target in TARGETS.items() if isinstance(instance, target))
+                entities[column].add(instance.id)
+    table = FavouritesSnapshot.__table__
+    conditions = [table.c.user_id.in_(users)] if users else []
+    favourites = Favourites.__table__
+    conditions += [
+        table.c.user_id.in_(select(favourites.c.users_favourites_id).where(favourites.c[column].in_(ids)))
+        for column, ids in entities.items() if ids
+    ]
+    if conditions:
+        session.connection().execute(
+            update(table).where(or_(*conditions)).values(items=None, version=table.c.version + 1)
+        )
+
+def count_favourites(column, entity_ids, delta, connection=None):
+    """Adds delta to the favourite counts of the planets/people, in the same transaction"""
+    if not entity_ids:
+        return
+    connection = connection or db.session.connection()
+    table = FavouriteCount.__table__
+    kind = COLUMN_KINDS[column]
+    # every transaction locks the rows in the same order, two batches can't wait on each other
+    entity_ids = sorted(set(entity_ids))
+    upsert = upsert_for(connection)
+    if upsert is not None:
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=["kind", "entity_id"], set_={"total": table.c.total + stmt.excluded.total})
+        connection.execute(stmt, [{"kind": kind, "entity_id": entity_id, "total": delta} for entity_id in entity_ids])
+        return
+    known = set(connection.scalars(select(table.c.entity_id).where(table.c.kind == kind, table.c.entity_id.in_(entity_ids))))
+    if known:
+        connection.execute(update(table).where(table.c.kind == kind, table.c.entity_id.in_(known)).values(total=table.c.total + delta))
+    missing = [{"kind": kind, "entity_id": entity_id, "total": delta} for entity_id in entity_ids if entity_id not in known]
+    if missing:
+        connection.execute(insert(table), missing)
+
+def reconcile_counts():
+    """
+    Counts the favourites of every person/planet again, one GROUP BY per kind, and fixes the
+    stored counts that are off. Returns how many were fixed, the caller commits
+    """
+    table = FavouriteCount.__table__
+    upsert = upsert_for(db.session.get_bind())
+    fixed = 0
+    for kind, column in KINDS.items():
+        # the counts are read first: a write committed after that changes its count, and the
+        # fixes below only apply to the counts still as read (the next run looks again)
+        stored = dict(db.session.execute(select(table.c.entity_id, table.c.total).where(table.c.kind == kind)).all())
+        target = Favourites.__table__.c[column]
+        actual = dict(db.session.execute(select(target, func.count()).where(target.isnot(None)).group_by(target)).all())
+        for entity_id, total in actual.items():
+            if entity_id not in stored:
+                stmt = insert(table) if upsert is None else upsert(table).on_conflict_do_nothing(index_elements=["kind", "entity_id"])
+                db.session.execute(stmt.values(kind=kind, entity_id=entity_id, total=total))
+            elif stored[entity_id] != total:
+                db.session.execute(update(table).where(table.c.kind == kind, table.c.entity_id == entity_id, table.c.total == stored[entity_id])
+                                   .values(total=total))
+            else:
+                continue
+            fixed += 1
+        # the people/planets nobody has anymore (or that were deleted)
+        for entity_id, total in stored.items():
+            if entity_id not in actual:
+                db.session.execute(delete(table).where(table.c.kind == kind, table.c.entity_id == entity_id, table.c.total == total))
+                if total != 0:
+                    fixed += 1
+    if fixed:
+        # the ETags of the popular endpoints are made of the version of favourites
+        bump_table_versions(db.session.connection(), ["favourites"])
+    return fixed
+
+# favourites written through the unit of work (the admin, insert_favourite without ON CONFLICT)
+@event.listens_for(Session, "after_flush")
+def count_flushed_favourites(session, flush_context):
+    deltas = {column: Counter() for column in KINDS.values()}
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(instance, Favourites):
+            continue
+        state = inspect(instance)
+        for column, counts in deltas.items():
+            history = state.attrs[column].history
+            if instance in session.deleted:
+                removed, added = chain(history.unchanged, history.deleted), ()
+            else:
+                removed, added = history.deleted, history.added
+            counts.subtract(entity_id for entity_id in removed if entity_id is not None)
+            counts.update(entity_id for entity_id in added if entity_id is not None)
+    for column, counts in deltas.items():
+        for delta in set(counts.values()) - {0}:
+            count_favourites(column, [entity_id for entity_id, total in counts.items() if total == delta], delta, session.connection())
+
+def insert_favourite(user_id, column, entity_id):
+    """
+    Adds the planet/person as a favourite of the user in a single INSERT ... SELECT ... ON CONFLICT DO NOTHING,
+    which only inserts when the entity exists and the user doesn't have it yet.
+    Returns the id of the new favourite, or None when nothing was inserted (see favourite_conflict).
+    """
+    target = TARGETS[column]
+    table = Favourites.__table__
+    source = select(literal(user_id), target.id).where(target.id == entity_id)
+    upsert = upsert_for(db.session.get_bind())
+    if upsert is not None:
+        stmt = upsert(table).from_select(["users_favourites_id", column], source).on_conflict_do_nothing(
+            index_elements=["users_favourites_id", column],
+            index_where=table.c[column].isnot(None)
+        )
+        favourite_id = db.session.execute(stmt.returning(table.c.id)).scalar_one_or_none()
+        if favourite_id is not None:
+            count_favourites(column, [entity_id], 1)
+    else:
+        # databases without ON CONFLICT: let the unique index reject the duplicates, the flush counts it
+        if db.session.get(target, entity_id) is None:
+            return None
+        favourite = Favourites(users_favourites_id=user_id, **{column: entity_id})
+        try:
+            with db.session.begin_nested():
+                db.session.add(favourite)
+        except IntegrityError:
+            return None
+        favourite_id = favourite.id
+    if favourite_id is not None:
+        update_snapshot(user_id, added=[favourite_id])
+    return favourite_id
+
+def favourite_conflict(column, entity_id):
+    """Why insert_favourite didn't insert anything: 'not found' or 'duplicate'"""
+    target = TARGETS[column]
+    if db.session.execute(select(target.id).where(target.id == entity_id)).first() is None:
+        return "not found"
+    return "duplicate"
+
+def remove_favourite(user_id, favourite_id, column=None):
+    """Deletes one favourite of the user, column restricts it to planet or people favourites. Returns the rows deleted"""
+    table = Favourites.__table__
+    conditions = [table.c.id == favourite_id, table.c.users_favourites_id == user_id]
+    if column is not None:
+        conditions.append(table.c[column].isnot(None))
+    # the person/planet it was, for its count
+    targets = [table.c[target] for target in KINDS.values()]
+    if db.session.get_bind().dialect.delete_returning:
+        rows = db.session.execute(delete(table).where(*conditions).returning(*targets)).all()
+    else:
+        rows = db.session.execute(select(*targets).where(*conditions).with_for_update()).all()
+        if rows:
+            db.session.execute(delete(table).where(*conditions))
+    for row in rows:
+        for target, entity_id in zip(KINDS.values(), row):
+            if entity_id is not None:
+                count_favourites(target, [entity_id], -1)
+    if rows:
+        update_snapshot(user_id, removed=[favourite_id])
+    return len(rows)
+
+
+def _id_list(value, where):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(item, int) and not isinstance(item, bool) for item in value):
+        raise ValueError(f"{where} must be a list of ids")
+    return list(dict.fromkeys(value))
+
+def apply_batch(user_id, changes):
+    """
+    Adds and removes many favourites of the user in one transaction:
+    {"add": {"planets": [ids], "people": [ids]}, "remove": {"planets": [ids], "people": [ids]}}
+    Every table is checked with one IN query, the existing favourites come in one more, and the
+    changes go out as one executemany INSERT and one DELETE per table.
+    Returns the outcome of every id, in the same shape as the request. Raises ValueError on a malformed body,
+    APIException when it holds more than MAX_BATCH_SIZE ids.
+    """
+    if not isinstance(changes, dict):
+        raise ValueError("the body must be an object with add and/or remove")
+    table = Favourites.__table__
+    add, remove = changes.get("add") or {}, changes.get("remove") or {}
+    if not isinstance(add, dict) or not isinstance(remove, dict):
+        raise ValueError("add and remove must be objects")
+    requested = {
+        kind: (_id_list(add.get(kind), f"add.{kind}"), _id_list(remove.get(kind), f"remove.{kind}"))
+        for kind in KINDS
+    }
+    if sum(len(to_add) + len(to_remove) for to_add, to_remove in requested.values()) > MAX_BATCH_SIZE:
+        raise APIException(f"a batch changes at most {MAX_BATCH_SIZE} favourites", status_code=400, payload={"max": MAX_BATCH_SIZE})
+    results = {"add": {}, "remove": {}}
+
+    touched = [table.c[KINDS[kind]].in_(to_add + to_remove) for kind, (to_add, to_remove) in requested.items() if to_add or to_remove]
+    if not touched:
+        return results
+    # (column, entity id) -> favourite id
+    existing = {}
+    for row in db.session.execute(select(table).where(table.c.users_favourites_id == user_id, or_(*touched))):
+        for column in KINDS.values():
+            if row._mapping[column] is not None:
+                existing[(column, row._mapping[column])] = row.id
+
+    upsert = upsert_for(db.session.get_bind())
+    inserted = []
+    for kind, (to_add, to_remove) in requested.items():
+        column = KINDS[kind]
+        both = set(to_add) & set(to_remove)
+        found = set()
+        if to_add:
+            target = TARGETS[column]
+            found = set(db.session.scalars(select(target.id).where(target.id.in_(to_add))))
+        add_results = results["add"][kind] = []
+        rows = []
+        for entity_id in to_add:
+            if entity_id in both:
+                add_results.append({"id": entity_id, "status": "can't add and remove it at once"})
+            elif entity_id not in found:
+                add_results.append({"id": entity_id, "status": "not found"})
+            elif (column, entity_id) in existing:
+                add_results.append({"id": entity_id, "status": "already a favourite", "favourite_id": existing[(column, entity_id)]})
+            else:
+                add_results.append({"id": entity_id, "status": "added"})
+                rows.append({"users_favourites_id": user_id, column: entity_id})
+        if rows:
+            # ON CONFLICT keeps a concurrent request that adds the same favourite from failing the whole batch
+            if upsert is None:
+                db.session.execute(insert(table), rows)
+                added = [row[column] for row in rows]
+            else:
+                stmt = upsert(table).on_conflict_do_nothing(
+                    index_elements=["users_favourites_id", column], index_where=table.c[column].isnot(None)
+                )
+                # only what this request inserted is counted
+                added = db.session.scalars(stmt.returning(table.c[column]), rows).all()
+            count_favourites(column, added, 1)
+            inserted.append(table.c[column].in_([row[column] for row in rows]))
+
+        remove_results = results["remove"][kind] = []
+        gone = []
+        for entity_id in to_remove:
+            if entity_id in both:
+                remove_results.append({"id": entity_id, "status": "can't add and remove it at once"})
+            elif (column, entity_id) not in existing:
+                remove_results.append({"id": entity_id, "status": "not a favourite"})
+            else:
+                remove_results.append({"id": entity_id, "status": "removed", "favourite_id": existing[(column, entity_id)]})
+                gone.append(existing[(column, entity_id)])
+        if gone:
+            stmt = delete(table).where(table.c.id.in_(gone))
+            if db.session.get_bind().dialect.delete_returning:
+                count_favourites(column, db.session.scalars(stmt.returning(table.c[column])).all(), -1)
+            else:
+                db.session.execute(stmt)
+                count_favourites(column, [entity_id for entity_id in to_remove if existing.get((column, entity_id)) in gone], -1)
+
+    new_ids = {}
+    if inserted:
+        for row in db.session.execute(select(table).where(table.c.users_favourites_id == user_id, or_(*inserted))):
+            for column in KINDS.values():
+                if row._mapping[column] is not None:
+                    new_ids[(column, row._mapping[column])] = row.id
+        for kind, add_results in results["add"].items():
+            for item in add_results:
+                if item["status"] == "added":
+                    item["favourite_id"] = new_ids.get((KINDS[kind], item["id"]))
+    removed = [item["favourite_id"] for remove_results in results["remove"].values() for item in remove_results if item["status"] == "removed"]
+    if new_ids or removed:
+        update_snapshot(user_id, added=list(new_ids.values()), removed=removed)
+    db.session.commit()
+    return results
@@ -0,0 +1,137 @@
+"""
+The films, starships, vehicles and species of people and planets as rows. The comma separated strings
+(People.films = "A New Hope, Return of the Jedi") stay what the API shows and takes, every write of
+them replaces the rows of the association tables (models.py) in the same transaction, so
+"everyone in film X" is an index lookup:
+
+    GET /films, /starships, /vehicles, /species             the entities, paginated
+    GET /films/3                                            one of them
+    GET /films/3/people, /species/1/planets, ...            its people/planets, with the filters of search.py
+
+The endpoint writes and the admin go through the after_flush hook below, the bulk import calls
+sync_links itself.
+"""
+from collections import defaultdict
+from itertools import chain
+from sqlalchemy import select, func, insert, delete, event, inspect
+from sqlalchemy.orm import Session
+from models import (People, Planets, Film, Starship, Vehicle, Species, Projection, UNKNOWN, bump_table_versions,
+                    people_films, people_starships, people_vehicles, people_species, planets_films, planets_species)
+from database import upsert_for
+
+# path segment of the endpoints -> entity
+ENTITIES = {
+    "films": Film,
+    "starships": Starship,
+    "vehicles": Vehicle,
+    "species": Species,
+}
+# string column -> (entity, association table), the tables list the owner column first
+LINKS = {
+    People: {"films": (Film, people_films), "starships": (Starship, people_starships),
+             "vehicles": (Vehicle, people_vehicles), "species": (Species, people_species)},
+    Planets: {"films": (Film, planets_films), "species": (Species, planets_species)},
+}
+ENTITY_PROJECTIONS = {kind: Projection(entity, ("id", "name")) for kind, entity in ENTITIES.items()}
+
+
+def split_names(value):
+    """"A New Hope,  return of the jedi, a new hope" -> ["A New Hope", "return of the jedi"]"""
+    if not isinstance(value, str):
+        return []
+    names = {}
+    for name in value.split(","):
+        name = " ".join(name.split())
+        if name.lower() not in UNKNOWN:
+            names.setdefault(name.lower(), name)
+    return list(names.values())
+
+def entity_ids(connection, entity, names):
+    """Lowercased name -> id of the entities called names, the missing ones are created"""
+    wanted = {}
+    for name in names:
+        wanted.setdefault(name.lower(), name)
+    if not wanted:
+        return {}
+    key = func.lower(entity.name)
+    ids = dict(connection.execute(select(key, entity.id).where(key.in_(wanted))).all())
+    missing = [name for lowered, name in wanted.items() if lowered not in ids]
+    if missing:
+        table = entity.__table__
+        upsert = upsert_for(connection)
+        # a concurrent writer may create the same ones, they are then simply there
+        stmt = upsert(table).on_conflict_do_nothing() if upsert is not None else insert(table)
+        connection.execute(stmt, [{"name": name} for name in missing])
+        ids.update(connection.execute(select(key, entity.id).where(key.in_([name.lower() for name in missing]))).all())
+        bump_table_versions(connection, [table.name])
+    return ids
+
+def sync_links(connection, model, values, replace=True):
+    """
+    values maps the id of people/planets rows to the strings written to them ({id: {"films": "..."}}),
+    the association rows of those strings are replaced (only added with replace=False, for new rows).
+    One lookup per entity and one DELETE and one executemany INSERT per association table, whatever the rows.
+    """
+    changed = set()
+    for field, (entity, table) in LINKS[model].items():
+        names = {owner_id: split_names(strings[field]) for owner_id, strings in values.items() if field in strings}
+        if not names:
+            continue
+        owner_column, entity_column = table.columns
+        ids = entity_ids(connection, entity, chain.from_iterable(names.values()))
+        if replace:
+            connection.execute(delete(table).where(owner_column.in_(names)))
+        rows = [{owner_column.name: owner_id, entity_column.name: ids[name.lower()]}
+                for owner_id, owner_names in names.items() for name in owner_names]
+        if rows:
+            connection.execute(insert(table), rows)
+        if replace or rows:
+            changed.add(table.name)
+    bump_table_versions(connection, changed)
+
+def unlink(connection, model, ids):
+    """Drops the association rows of deleted people/planets, SQLite doesn't enforce the cascades"""
+    tables = [table for _, table in LINKS[model].values()]
+    for table in tables:
+        owner_column = table.columns[0]
+        connection.execute(delete(table).where(owner_column.in_(ids)))
+    bump_table_versions(connection, [table.name for table in tables])
+
+def linked_to(stmt, model, kind, entity_id):
+    """Restricts a select of people/planets to the ones linked to the entity, through the (entity, owner) index"""
+    for entity, table in LINKS[model].values():
+        if entity is ENTITIES[kind]:
+            owner_column, entity_column = table.columns
+            return stmt.join(table, owner_column == model.id).where(entity_column == entity_id)
+    raise KeyError(f"{model.__tablename__} aren't linked to {kind}")
+
+
+# writes through the unit of work (the endpoints, the admin)
+@event.listens_for(Session, "after_flush")
+def sync_flushed_links(session, flush_context):
+    created = defaultdict(dict)
+    updated = defaultdict(dict)
+    deleted = defaultdict(list)
+    for instance in chain(session.new, session.dirty):
+        fields = LINKS.get(type(instance))
+        if fields is None:
+            continue
+        if instance in session.new:
+            strings = {field: getattr(instance, field) for field in fields if getattr(instance, field)}
+            target = created
+        else:
+            state = inspect(instance)
+            strings = {field: getattr(instance, field) for field in fields if state.attrs[field].history.has_changes()}
+            target = updated
+        if strings:
+            target[type(instance)][instance.id] = strings
+    for instance in session.deleted:
+        if type(instance) in LINKS:
+            deleted[type(instance)].append(instance.id)
+    connection = session.connection()
+    for model, values in created.items():
+        sync_links(connection, model, values, replace=False)
+    for model, values in updated.items():
+        sync_links(connection, model, values)
+    for model, ids in deleted.items():
+        unlink(connection, model, ids)
@@ -0,0 +1,156 @@
+"""
+Per request instrumentation: duration, number of SQL statements, time spent in the database
+(engine events), time spent encoding JSON (the app JSON provider) and response size, by route.
+Requests slower than METRICS_SLOW_MS (500 by default) are logged with their statements.
+GET /metrics shows the histograms in the Prometheus text format. They are kept per process, with
+several gunicorn workers every scrape sees the worker that answered it.
+Streamed responses are measured until their first byte, the rows sent afterwards aren't counted.
+"""
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from models import db
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENTS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# statements kept per request for the slow request log
+MAX_STATEMENTS = 50
+
+
+def label_set(labels, **extra):
+    pairs = {**labels, **extra}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs.items()) + "}"
+
+
+class Histogram:
+    def __init__(self, name, description, buckets, labels):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                pairs = dict(zip(self.labels, labels))
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{label_set(pairs, le=bound)} {count}")
+                lines.append(f"{self.name}_bucket{label_set(pairs, le='+Inf')} {series['count']}")
+                lines.append(f"{self.name}_sum{label_set(pairs)} {series['sum']}")
+                lines.append(f"{self.name}_count{label_set(pairs)} {series['count']}")
+        return "\n".join(lines)
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to produce the response", SECONDS, ("method", "route", "status"))
+DB_STATEMENTS = Histogram("http_request_db_statements", "SQL statements sent per request", STATEMENTS, ("method", "route"))
+DB_SECONDS = Histogram("http_request_db_seconds", "Time spent waiting for the database per request", SECONDS, ("method", "route"))
+SERIALIZATION_SECONDS = Histogram("http_request_serialization_seconds", "Time spent encoding JSON per request", SECONDS, ("method", "route"))
+RESPONSE_BYTES = Histogram("http_response_size_bytes", "Size of the response body as sent", BYTES, ("method", "route"))
+HISTOGRAMS = (REQUEST_SECONDS, DB_STATEMENTS, DB_SECONDS, SERIALIZATION_SECONDS, RESPONSE_BYTES)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []
+        self.statement_count = 0
+        self.db_seconds = 0
+        self.serialization_seconds = 0
+        # nested encodes (response() calling dumps()) are only counted once
+        self.encoding = False
+
+
+def current():
+    # the engine and the JSON provider are also used outside requests (commands, scripts)
+    return g.get("metrics") if has_request_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("metrics_started")
+    metrics = current()
+    if metrics is None:
+        return
+    metrics.statement_count += 1
+    metrics.db_seconds += elapsed
+    if len(metrics.statements) < MAX_STATEMENTS:
+        metrics.statements.append((elapsed, statement))
+
+
+def timed_encoding(encode):
+    def wrapper(*args, **kwargs):
+        metrics = current()
+        if metrics is None or metrics.encoding:
+            return encode(*args, **kwargs)
+        metrics.encoding = True
+        start = time.perf_counter()
+        try:
+            return encode(*args, **kwargs)
+        finally:
+            metrics.serialization_seconds += time.perf_counter() - start
+            metrics.encoding = False
+    return wrapper
+
+
+def route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def render():
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+
+
+def setup_metrics(app):
+    slow = float(os.getenv("METRICS_SLOW_MS", 500)) / 1000
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+    app.json.dumps = timed_encoding(app.json.dumps)
+    app.json.response = timed_encoding(app.json.response)
+
+    @app.before_request
+    def start_metrics():
+        g.metrics = RequestMetrics()
+
+    # registered before the compression hook so it runs after it, the size is the one sent
+    @app.after_request
+    def record_metrics(response):
+        metrics = current()
+        if metrics is None:
+            return response
+        elapsed = time.perf_counter() - metrics.start
+        labels = (request.method, route())
+        REQUEST_SECONDS.observe(elapsed, *labels, str(response.status_code))
+        DB_STATEMENTS.observe(metrics.statement_count, *labels)
+        DB_SECONDS.observe(metrics.db_seconds, *labels)
+        SERIALIZATION_SECONDS.observe(metrics.serialization_seconds, *labels)
+        if not response.is_streamed:
+            RESPONSE_BYTES.observe(response.calculate_content_length() or 0, *labels)
+        if elapsed >= slow:
+            statements = "\n".join(f"  {seconds * 1000:.1f}ms {' '.join(statement.split())}" for seconds, statement in metrics.statements)
+            app.logger.warning(
+                "slow request %s %s: %.0fms, %d statements in %.0fms, %.0fms encoding\n%s",
+                request.method, request.full_path, elapsed * 1000, metrics.statement_count,
+                metrics.db_seconds * 1000, metrics.serialization_seconds * 1000, statements
+            )
+        return response
@@ -1,7 +1,11 @@
+import math
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import mapped_column, Mapped, relationship
-from sqlalchemy import ForeignKey, Integer, String, Float
+from sqlalchemy.orm import mapped_column, Mapped, relationship, joinedload, selectinload, aliased, Session
+from sqlalchemy import ForeignKey, Integer, String, Float, DateTime, JSON, Index, DDL, func, text, event, select, update, insert
 from typing import List
+from datetime import datetime
+from itertools import chain
+from collections import defaultdict
 
 db = SQLAlchemy()
 
@@ -10,8 +14,10 @@ class User(db.Model):
     __tablename__ = "user"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str] = mapped_column(String(120), nullable=False)
-    password: Mapped[str] = mapped_column(String(80), nullable=False)
+    # always stored lowercased, see normalize_email in app.py
+    email: Mapped[str] = mapped_column(String(120), nullable=False, unique=True, index=True)
+    # scrypt hash, see passwords.py
+    password: Mapped[str] = mapped_column(String(255), nullable=False)
     favourites_users: Mapped[List["Favourites"]] = relationship(back_populates="users_favourites")
 
     def __repr__(self):
@@ -31,8 +37,24 @@ class User(db.Model):
             "email": self.email
         }
 
+class RevokedToken(db.Model):
+    """JWTs revoked before they expire (POST /logout), see revocation.py"""
+    __tablename__ = "revoked_token"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    jti: Mapped[str] = mapped_column(String(36), nullable=False, unique=True)
+    # naive UTC, the rows can go once the token expired anyway
+    expires: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
 class Favourites(db.Model):
     __tablename__= "favourites"
+    __table_args__ = (
+        Index("ix_favourites_user", "users_favourites_id"),
+        # a user can only have each planet/person once, the favourite writes upsert against these
+        Index("ix_favourites_user_planet", "users_favourites_id", "planet_favourites_id", unique=True,
+              sqlite_where=text("planet_favourites_id IS NOT NULL"), postgresql_where=text("planet_favourites_id IS NOT NULL")),
+        Index("ix_favourites_user_people", "users_favourites_id", "people_favourites_id", unique=True,
+              sqlite_where=text("people_favourites_id IS NOT NULL"), postgresql_where=text("people_favourites_id IS NOT NULL")),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     # relación con usuarios
     users_favourites_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
@@ -53,6 +75,28 @@ class Favourites(db.Model):
         }
     
 
+class FavouritesSnapshot(db.Model):
+    """The favourites of a user as GET /user/favorites shows them, kept up to date by the writes of favourites.py"""
+    __tablename__ = "favourites_snapshot"
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    # bumped by every write, a read that built the items meanwhile doesn't store them
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # [{"id": favourite id, "people": {"id", "name"} or None, "planets": ...}], NULL until a read builds them
+    items: Mapped[list] = mapped_column(JSON(none_as_null=True), nullable=True)
+
+class FavouriteCount(db.Model):
+    """How many users have each person/planet as a favourite, kept up to date by the writes of favourites.py"""
+    __tablename__ = "favourite_count"
+    __table_args__ = (
+        # GET /people/popular and /planets/popular read the top of it backwards
+        Index("ix_favourite_count_top", "kind", "total", "entity_id"),
+    )
+    # "people" or "planets" (favourites.KINDS), the id of the person/planet
+    kind: Mapped[str] = mapped_column(String(10), primary_key=True)
+    entity_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
 class People(db.Model):
     __tablename__= "people"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -61,8 +105,9 @@ class People(db.Model):
     eye_color: Mapped[str] = mapped_column(String(50), nullable=True)
     gender: Mapped[str] = mapped_column(String(50), nullable=True)
     hair_color: Mapped[str] = mapped_column(String(50), nullable=True)
-    height: Mapped[str] = mapped_column(String(50), nullable=True)
-    weight: Mapped[str] = mapped_column(String(50), nullable=True)
+    # cm and kg, NULL when unknown (see MEASURES)
+    height: Mapped[int] = mapped_column(Integer, nullable=True)
+    weight: Mapped[float] = mapped_column(Float, nullable=True)
     skin_color: Mapped[str] = mapped_column(String(50), nullable=True)
     species: Mapped[str] = mapped_column(String(50), nullable=True)
     starships: Mapped[str] = mapped_column(String(250), nullable=True)
@@ -102,18 +147,33 @@ class People(db.Model):
             "name": self.name
         }
 
+# names are unique regardless of case, the index also serves the duplicate lookups
+Index("ix_people_name_lower", func.lower(People.name), unique=True)
+# filters of GET /people, see search.py
+Index("ix_people_gender", People.gender)
+Index("ix_people_species", People.species)
+Index("ix_people_eye_color", People.eye_color)
+Index("ix_people_hair_color", People.hair_color)
+Index("ix_people_skin_color", People.skin_color)
+Index("ix_people_birth_year", People.birth_year)
+Index("ix_people_homeworld_id", People.homeworld_id)
+Index("ix_people_height", People.height)
+Index("ix_people_weight", People.weight)
+
 class Planets(db.Model):
     __tablename__= "planets"
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(250), nullable=False)
-    diameter: Mapped[str] = mapped_column(String(50), nullable=True)
-    rotation_period: Mapped[str] = mapped_column(String(50), nullable=True)
-    orbital_period: Mapped[str] = mapped_column(String(50), nullable=True)
+    # km, hours and days, NULL when unknown (see MEASURES)
+    diameter: Mapped[int] = mapped_column(Integer, nullable=True)
+    rotation_period: Mapped[int] = mapped_column(Integer, nullable=True)
+    orbital_period: Mapped[int] = mapped_column(Integer, nullable=True)
     gravity: Mapped[float] = mapped_column(Float, nullable=True)
     population: Mapped[int] = mapped_column(nullable=True)
     climate: Mapped[str] = mapped_column(String(50), nullable=True)
     terrain: Mapped[str] = mapped_column(String(50), nullable=True)
-    surface_water: Mapped[str] = mapped_column(String(50), nullable=True)
+    # percentage of the surface
+    surface_water: Mapped[float] = mapped_column(Float, nullable=True)
     image: Mapped[str] = mapped_column(String, nullable=True)
     species: Mapped[str] = mapped_column(String(100), nullable=True)
     films: Mapped[str] = mapped_column(String(500), nullable=True)
@@ -144,6 +204,292 @@ class Planets(db.Model):
             "name": self.name
         }
 
+Index("ix_planets_name_lower", func.lower(Planets.name), unique=True)
+Index("ix_planets_climate", Planets.climate)
+Index("ix_planets_terrain", Planets.terrain)
+Index("ix_planets_population", Planets.population)
+Index("ix_planets_gravity", Planets.gravity)
+Index("ix_planets_diameter", Planets.diameter)
+Index("ix_planets_rotation_period", Planets.rotation_period)
+Index("ix_planets_orbital_period", Planets.orbital_period)
+Index("ix_planets_surface_water", Planets.surface_water)
+
+# numeric columns that used to be strings, the writes still take them as "1,358" or "unknown"
+MEASURES = {
+    People: ("height", "weight"),
+    Planets: ("diameter", "rotation_period", "orbital_period", "surface_water"),
+}
+# placeholders of the source data for a value nobody knows
+UNKNOWN = {"", "unknown", "n/a", "none"}
+
+def to_number(value, kind):
+    """"1,358" -> 1358, "unknown" -> None, raises ValueError on anything else that isn't a number"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(",", "")
+        if value.lower() in UNKNOWN:
+            return None
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{value!r} isn't a number")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value!r} isn't a number")
+    return round(number) if kind is int else number
+
+def parse_measures(record, model):
+    """The MEASURES of a record sent to the API as numbers, raises ValueError naming the first bad one"""
+    numbers = {}
+    for field in MEASURES[model]:
+        if field not in record:
+            continue
+        try:
+            numbers[field] = to_number(record[field], getattr(model, field).type.python_type)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a number")
+    return numbers
+
+
+# the films, starships, vehicles and species named by the comma separated People/Planets strings,
+# each one once. The strings are still what the API shows and takes, links.py keeps the association
+# tables below in step with them.
+class NamedEntity:
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(250), nullable=False)
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.name)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "name": self.name
+        }
+
+class Film(NamedEntity, db.Model):
+    __tablename__ = "films"
+
+class Starship(NamedEntity, db.Model):
+    __tablename__ = "starships"
+
+class Vehicle(NamedEntity, db.Model):
+    __tablename__ = "vehicles"
+
+class Species(NamedEntity, db.Model):
+    __tablename__ = "species"
+
+for entity in (Film, Starship, Vehicle, Species):
+    Index(f"ix_{entity.__tablename__}_name_lower", func.lower(entity.name), unique=True)
+
+def association(owner, entity, owner_column, entity_column):
+    """owner <-> entity table, the primary key looks up the entities of an owner, the index the owners of an entity"""
+    name = f"{owner}_{entity}"
+    return db.Table(
+        name,
+        db.Column(owner_column, ForeignKey(f"{owner}.id", ondelete="CASCADE"), primary_key=True),
+        db.Column(entity_column, ForeignKey(f"{entity}.id", ondelete="CASCADE"), primary_key=True),
+        Index(f"ix_{name}_{entity_column}", entity_column, owner_column),
+    )
+
+people_films = association("people", "films", "people_id", "film_id")
+people_starships = association("people", "starships", "people_id", "starship_id")
+people_vehicles = association("people", "vehicles", "people_id", "vehicle_id")
+people_species = association("people", "species", "people_id", "species_id")
+planets_films = association("planets", "films", "planet_id", "film_id")
+planets_species = association("planets", "species", "planet_id", "species_id")
+
+
+# text search over name and films (?q=, see search.py): an FTS5 table kept in sync by triggers on
+# SQLite, a GIN index over the same tsvector expression the queries use on Postgres.
+# The migration creates them on existing databases, these hooks on the ones made by create_all().
+def search_document(model):
+    # literals rather than parameters, the queries must spell the same expression as the index
+    document = func.coalesce(model.name, text("''")).op("||")(text("' '")).op("||")(func.coalesce(model.films, text("''")))
+    return func.to_tsvector(text("'simple'"), document)
+
+def fts5_statements(table):
+    return (
+        f"CREATE VIRTUAL TABLE {table}_fts USING fts5(name, films, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_fts(rowid, name, films) VALUES (new.id, new.name, new.films); END",
+        f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name, films) VALUES ('delete', old.id, old.name, old.films); END",
+        f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF name, films ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name, films) VALUES ('delete', old.id, old.name, old.films); "
+        f"INSERT INTO {table}_fts(rowid, name, films) VALUES (new.id, new.name, new.films); END",
+    )
+
+for model in (People, Planets):
+    Index(f"ix_{model.__tablename__}_search", search_document(model), postgresql_using="gin").ddl_if(dialect="postgresql")
+    for statement in fts5_statements(model.__tablename__):
+        event.listen(model.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(model.__table__, "before_drop", DDL(f"DROP TABLE IF EXISTS {model.__tablename__}_fts").execute_if(dialect="sqlite"))
+
+# serialization profiles: for every serialize method, the relationships it walks.
+# queries that serialize their rows apply these loader options so the relationships
+# come in a fixed number of queries instead of one lazy SELECT per row.
+PEOPLE_PROFILES = {
+    "serialize": (joinedload(People.homeworld),),
+    "homeworld_serialize": (),
+}
+PLANETS_PROFILES = {
+    "serialize": (selectinload(Planets.residents),),
+    "residents_serialize": (),
+}
+FAVOURITES_PROFILES = {
+    "serialize": (
+        joinedload(Favourites.users_favourites),
+        joinedload(Favourites.people_favourites).joinedload(People.homeworld),
+        joinedload(Favourites.planet_favourites).selectinload(Planets.residents),
+    ),
+}
+USER_PROFILES = {
+    # the favourites already know their user through the identity map, no need to join it again
+    "serialize": (
+        selectinload(User.favourites_users).options(
+            joinedload(Favourites.people_favourites).joinedload(People.homeworld),
+            joinedload(Favourites.planet_favourites).selectinload(Planets.residents),
+        ),
+    ),
+    "favourites_serialize": (),
+}
+SERIALIZER_PROFILES = {
+    People: PEOPLE_PROFILES,
+    Planets: PLANETS_PROFILES,
+    Favourites: FAVOURITES_PROFILES,
+    User: USER_PROFILES,
+}
+
+def serializer_options(model, profile="serialize"):
+    return SERIALIZER_PROFILES[model][profile]
+
+# column projections: the read endpoints select only the columns behind the fields they were asked for
+# (?fields=, all of them by default) as plain rows and build the same dicts as serialize() from them,
+# without creating ORM instances. "id" is always selected and returned.
+class JoinedName:
+    """Many-to-one shown as {"id", "name"}, comes in the same query through an outer join"""
+
+    def __init__(self, relationship, target):
+        self.relationship = relationship
+        self.target = target
+
+    def extend(self, stmt):
+        other = aliased(self.target)
+        return stmt.add_columns(other.id, other.name).outerjoin(other, self.relationship.of_type(other))
+
+    def fill(self, field, rows, results, offset):
+        for row, result in zip(rows, results):
+            result[field] = {"id": row[offset], "name": row[offset + 1]} if row[offset] is not None else None
+        return offset + 2
+
+class CollectedNames:
+    """One-to-many shown as a list of {"id", "name"} (None when empty), one IN query for the whole batch"""
+
+    def __init__(self, foreign_key, target):
+        self.foreign_key = foreign_key
+        self.target = target
+
+    def extend(self, stmt):
+        return stmt
+
+    def fill(self, field, rows, results, offset):
+        collected = defaultdict(list)
+        ids = [result["id"] for result in results]
+        if ids:
+            stmt = select(self.foreign_key, self.target.id, self.target.name).where(self.foreign_key.in_(ids)).order_by(self.target.id)
+            for owner_id, item_id, name in db.session.execute(stmt):
+                collected[owner_id].append({"id": item_id, "name": name})
+        for result in results:
+            result[field] = collected.get(result["id"]) or None
+        return offset
+
+class Projection:
+    def __init__(self, model, columns, relations=None):
+        self.model = model
+        self.columns = columns
+        self.relations = relations or {}
+        self.fields = columns + tuple(self.relations)
+
+    def _columns(self, fields):
+        return tuple(column for column in self.columns if fields is None or column == "id" or column in fields)
+
+    def _relations(self, fields):
+        return [(field, relation) for field, relation in self.relations.items() if fields is None or field in fields]
+
+    def select(self, fields=None):
+        stmt = select(*(getattr(self.model, column) for column in self._columns(fields)))
+        for field, relation in self._relations(fields):
+            stmt = relation.extend(stmt)
+        return stmt
+
+    def serializer(self, fields=None):
+        columns = self._columns(fields)
+        relations = self._relations(fields)
+
+        def serialize(rows):
+            results = [dict(zip(columns, row)) for row in rows]
+            offset = len(columns)
+            for field, relation in relations:
+                offset = relation.fill(field, rows, results, offset)
+            return results
+        return serialize
+
+PEOPLE_PROJECTION = Projection(
+    People,
+    ("id", "name", "birth_year", "eye_color", "gender", "hair_color", "height", "weight", "skin_color",
+     "species", "starships", "vehicles", "master", "disciple", "image", "films"),
+    {"homeworld": JoinedName(People.homeworld, Planets)}
+)
+PLANETS_PROJECTION = Projection(
+    Planets,
+    ("id", "name", "diameter", "rotation_period", "orbital_period", "gravity", "population", "climate",
+     "terrain", "surface_water", "image", "species", "films"),
+    {"residents": CollectedNames(People.homeworld_id, People)}
+)
+USER_PROJECTION = Projection(User, ("id", "email"))
+
+class TableVersion(db.Model):
+    """Bumped in the same transaction as every write to a table, the ETags of the read endpoints come from here"""
+    __tablename__ = "table_version"
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+def table_versions(names):
+    rows = dict(db.session.execute(select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(names))).all())
+    return [rows.get(name, 0) for name in names]
+
+# tables no ETag is made of, their writes don't need a bump. favourite_count only changes
+# along with favourites, the version of favourites stands for both
+UNVERSIONED = {"table_version", "favourites_snapshot", "favourite_count", "revoked_token"}
+
+def bump_table_versions(connection, names):
+    names = sorted(set(names) - UNVERSIONED)
+    if not names:
+        return
+    table = TableVersion.__table__
+    result = connection.execute(update(table).where(table.c.name.in_(names)).values(version=table.c.version + 1))
+    if result.rowcount < len(names):
+        existing = set(connection.scalars(select(table.c.name).where(table.c.name.in_(names))))
+        connection.execute(insert(table), [{"name": name, "version": 1} for name in names if name not in existing])
+
+# writes through the unit of work (the endpoints, the admin)
+@event.listens_for(Session, "after_flush")
+def bump_flushed_tables(session, flush_context):
+    changed = chain(session.new, session.dirty, session.deleted)
+    bump_table_versions(session.connection(), {instance.__table__.name for instance in changed})
+
+# insert/update/delete statements sent through the session
+@event.listens_for(Session, "do_orm_execute")
+def bump_executed_tables(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    result = orm_execute_state.invoke_statement()
+    # rowcount isn't reliable with RETURNING (SQLite counts the rows once they're fetched),
+    # only skip the plain statements known to have changed nothing
+    if result.returns_rows or getattr(result, "rowcount", -1) != 0:
+        bump_table_versions(orm_execute_state.session.connection(), [orm_execute_state.statement.table.name])
+    return result
+
 # from flask_sqlalchemy import SQLAlchemy
 
 # db = SQLAlchemy()
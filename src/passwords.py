@@ -0,0 +1,104 @@
+"""
+Password hashing with scrypt (hashlib, no extra dependency).
+The cost comes from PASSWORD_SCRYPT_N / PASSWORD_SCRYPT_R / PASSWORD_SCRYPT_P, every hash stores the
+parameters it was made with, so changing them only affects new hashes and the old ones are
+upgraded the next time their owner logs in.
+Hashing runs in a bounded pool of PASSWORD_HASH_WORKERS threads (hashlib releases the GIL while
+scrypt runs) with at most PASSWORD_HASH_QUEUE jobs waiting, when it is full we refuse instead of
+piling up requests that would starve the rest of the API.
+Both limits are per gunicorn worker: the host runs up to WEB_CONCURRENCY * PASSWORD_HASH_WORKERS
+hashes at once, ~16MB each with the default cost.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from gevent import monkey, get_hub
+except ImportError:
+    # only there with the gevent workers, see gunicorn.conf.py
+    monkey = None
+
+PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def cost_from_env():
+    return (
+        int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14)),
+        int(os.getenv("PASSWORD_SCRYPT_R", 8)),
+        int(os.getenv("PASSWORD_SCRYPT_P", 1))
+    )
+
+COST = cost_from_env()
+# the cores of one gunicorn worker (gunicorn.conf.py), at most 2 threads of ~16MB each
+CORES_PER_WORKER = max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", 2)))
+WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(2, CORES_PER_WORKER)))
+QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", WORKERS * 4))
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="password-hash")
+_slots = threading.BoundedSemaphore(WORKERS + QUEUE)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    # scrypt needs 128 * n * r bytes, OpenSSL refuses anything above 32MB unless told otherwise
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES)
+
+
+def hash_password_sync(password, cost=None):
+    n, r, p = cost or COST
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f"{PREFIX}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+def is_hashed(stored):
+    return stored.startswith(PREFIX + "$")
+
+def verify_password_sync(password, stored, cost=None):
+    """Returns (valid, new_hash), new_hash is only set when the stored hash should be replaced"""
+    cost = cost or COST
+    if not is_hashed(stored):
+        # 1bcd569d5e42 hashed the plain passwords and the admin hashes what it saves, nothing else logs in
+        return False, None
+    _, n, r, p, salt, expected = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    valid = hmac.compare_digest(_scrypt(password, _unb64(salt), n, r, p), _unb64(expected))
+    if valid and (n, r, p) != tuple(cost):
+        return True, hash_password_sync(password, cost)
+    return valid, None
+
+
+def _execute(fn, *args):
+    # once gevent patches threading the executor threads are greenlets, scrypt would block every
+    # other request of the worker, the hub threadpool runs it on a real thread
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return get_hub().threadpool.apply(fn, args)
+    return _pool.submit(fn, *args).result()
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HasherBusy()
+    try:
+        return _execute(fn, *args)
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    return _run(hash_password_sync, password)
+
+def verify_password(password, stored):
+    return _run(verify_password_sync, password, stored)
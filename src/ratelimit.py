@@ -0,0 +1,186 @@
+"""
+Token bucket rate limiting of the credential endpoints (/login, /signup), by client IP and by email.
+A bucket holds up to `capacity` attempts and gets them back at capacity/period per second, an empty
+bucket answers 429 with Retry-After before the view runs: no user lookup, no password hashing.
+
+    RATELIMIT_URL=local                 buckets in the worker's memory (default), every gunicorn
+                                        worker has its own: with WEB_CONCURRENCY=2 a client gets up
+                                        to twice the attempts, depending on the worker it reaches
+    RATELIMIT_URL=redis://...           buckets shared by every worker, updated atomically by a script
+    RATELIMIT_LOGIN_IP=20/60            20 attempts per minute per IP
+    RATELIMIT_LOGIN_EMAIL=5/60          5 attempts per minute per account
+    RATELIMIT_SIGNUP_IP=5/600
+    TRUSTED_PROXIES=1                   proxies in front of the app (render, heroku), their
+                                        X-Forwarded-For gives the client IP. Without it every client
+                                        has the router's IP and they all share one bucket
+
+memory:// is the stand-in for redis:// in one process: the same SharedBuckets code runs against it,
+with token_bucket, the Python version of the script. It is per worker too, setup_ratelimit warns when
+several workers run with either of them.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
+import store
+
+DEFAULT_LIMITS = {
+    "login:ip": "20/60",
+    "login:email": "5/60",
+    "signup:ip": "5/600",
+}
+MAX_LOCAL_BUCKETS = 100000
+
+# KEYS[1] bucket, ARGV capacity and refill rate (tokens/s); returns the seconds to wait, 0 when allowed
+TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+def token_bucket(client, keys, args):
+    """TOKEN_BUCKET for store.MemoryStore, step by step"""
+    capacity, rate = float(args[0]), float(args[1])
+    seconds, microseconds = client.time()
+    now = seconds + microseconds / 1000000
+    tokens, updated = client.hmget(keys[0], ["tokens", "updated"])
+    tokens = float(tokens) if tokens is not None else capacity
+    updated = float(updated) if updated is not None else now
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    wait = 0
+    if tokens >= 1:
+        tokens = tokens - 1
+    else:
+        wait = (1 - tokens) / rate
+    client.hset(keys[0], mapping={"tokens": tokens, "updated": now})
+    client.expire(keys[0], math.ceil(capacity / rate) + 1)
+    return str(wait).encode()
+
+store.MemoryStore.scripts[TOKEN_BUCKET] = token_bucket
+
+
+def parse_limit(limit):
+    """"5/60" -> (5, 60.0): 5 attempts every 60 seconds"""
+    capacity, period = limit.split("/")
+    return int(capacity), float(period)
+
+
+class LocalBuckets:
+    def __init__(self, max_buckets=MAX_LOCAL_BUCKETS):
+        self.max_buckets = max_buckets
+        # key -> (tokens, updated), the least recently used buckets go first when it is full
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedBuckets:
+    """Buckets in redis (or memory://), the script reads and refills them atomically with the server clock"""
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.prefix = prefix
+        self.client = client
+        self._script = client.register_script(TOKEN_BUCKET)
+
+    def take(self, key, capacity, rate):
+        return float(self._script(keys=[self.prefix + key], args=[capacity, rate]))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.backend = LocalBuckets()
+        self.limits = {name: parse_limit(limit) for name, limit in DEFAULT_LIMITS.items()}
+
+    def configure(self, url="local", limits=None):
+        if url == "local":
+            self.backend = LocalBuckets()
+        else:
+            self.backend = SharedBuckets(store.connect(url))
+        self.limits.update({name: parse_limit(limit) for name, limit in (limits or {}).items()})
+
+    def wait(self, name, value):
+        """Takes a token from the name bucket of value, returns the seconds to wait (0 when allowed)"""
+        capacity, period = self.limits[name]
+        return self.backend.take(f"{name}:{value}", capacity, capacity / period)
+
+
+limiter = RateLimiter()
+
+
+def rate_limited(action, by_email=False):
+    """Refuses the request with 429 once the client IP (or the email of the JSON body) used up its bucket"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            wait = limiter.wait(f"{action}:ip", request.remote_addr)
+            if by_email:
+                body = request.get_json(silent=True)
+                email = body.get("email") if isinstance(body, dict) else None
+                if isinstance(email, str) and email.strip():
+                    wait = max(wait, limiter.wait(f"{action}:email", email.strip().lower()))
+            if wait > 0:
+                retry_after = math.ceil(wait)
+                return jsonify({"msg": f"too many attempts, try again in {retry_after} seconds"}), 429, {"Retry-After": str(retry_after)}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def setup_ratelimit(app):
+    # "login:ip" comes from RATELIMIT_LOGIN_IP
+    variables = {name: "RATELIMIT_" + name.replace(":", "_").upper() for name in DEFAULT_LIMITS}
+    limits = {name: os.environ[variable] for name, variable in variables.items() if variable in os.environ}
+    url = os.getenv("RATELIMIT_URL", "local")
+    limiter.configure(url=url, limits=limits)
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1 and (url == "local" or url.startswith("memory://")):
+        app.logger.warning(
+            "RATELIMIT_URL=%s keeps the buckets per worker, the %d workers allow up to %d times every limit, "
+            "set RATELIMIT_URL=redis://...", url, workers, workers
+        )
+    # render and heroku set RENDER/DYNO, their router is always there
+    behind_router = "RENDER" in os.environ or "DYNO" in os.environ
+    proxies = int(os.getenv("TRUSTED_PROXIES", 1 if behind_router else 0))
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
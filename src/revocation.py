@@ -0,0 +1,127 @@
+"""
+Revoked tokens (POST /logout). The revoked_token table is the authority, every worker keeps a Bloom
+filter of it in memory so @jwt_required() checks a token with a few hashes instead of a query:
+
+  - a token the filter doesn't know was never revoked, nothing else to check
+  - a token it knows is confirmed by a lookup on the unique jti index, the filter has ~1% false positives
+  - the revocations made by other workers are added every REVOCATION_SYNC_SECONDS (5 by default),
+    one query for the rows after the last one seen. Until then another worker still accepts the
+    token, the worker that revoked it refuses it at once.
+
+The filter holds REVOCATION_CAPACITY tokens (100000 by default, ~120KB), it is rebuilt from the
+unexpired rows when it gets fuller. `flask prune-revoked-tokens` deletes the expired rows.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, insert, delete
+from models import db, RevokedToken
+from database import upsert_for
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_SYNC_SECONDS = 5
+ERROR_RATE = 0.01
+# ids are handed out before the transactions commit, so rows can appear behind the last id seen:
+# every sync reads this many ids back again
+SYNC_OVERLAP = 100
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # double hashing, the two halves of one digest give all the positions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, key):
+        if key in self:
+            return
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def utcnow():
+    # the table stores naive UTC datetimes
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def expiry(jwt_data):
+    return datetime.fromtimestamp(jwt_data["exp"], timezone.utc).replace(tzinfo=None)
+
+
+class RevocationList:
+    def __init__(self, capacity=DEFAULT_CAPACITY, sync_seconds=DEFAULT_SYNC_SECONDS):
+        self.configure(capacity, sync_seconds)
+
+    def configure(self, capacity=DEFAULT_CAPACITY, sync_seconds=DEFAULT_SYNC_SECONDS):
+        self.capacity = capacity
+        self.sync_seconds = sync_seconds
+        self.filter = BloomFilter(capacity)
+        self.last_id = 0
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def stale(self):
+        return self.synced_at is None or time.monotonic() - self.synced_at >= self.sync_seconds
+
+    def sync(self, force=False):
+        """Adds the revocations made since the last sync, by any worker, to the filter"""
+        with self._lock:
+            # the other threads waiting on the lock find it done
+            if not force and not self.stale():
+                return
+            if self.filter.count >= self.capacity:
+                # a fuller filter gives more false positives, start again from the rows still valid
+                self.filter = BloomFilter(self.capacity)
+                self.last_id = 0
+            stmt = (select(RevokedToken.id, RevokedToken.jti)
+                    .where(RevokedToken.id > self.last_id - SYNC_OVERLAP, RevokedToken.expires > utcnow())
+                    .order_by(RevokedToken.id))
+            for row_id, jti in db.session.execute(stmt):
+                self.filter.add(jti)
+                self.last_id = max(self.last_id, row_id)
+            self.synced_at = time.monotonic()
+
+    def is_revoked(self, jti):
+        if self.stale():
+            self.sync()
+        if jti not in self.filter:
+            return False
+        return db.session.execute(select(RevokedToken.id).filter_by(jti=jti)).first() is not None
+
+    def revoke(self, tokens):
+        """Revokes the decoded tokens (their jti and exp) in the current transaction"""
+        rows = [{"jti": token["jti"], "expires": expiry(token)} for token in tokens]
+        table = RevokedToken.__table__
+        upsert = upsert_for(db.session.get_bind())
+        if upsert is not None:
+            db.session.execute(upsert(table).on_conflict_do_nothing(index_elements=["jti"]), rows)
+        else:
+            known = set(db.session.scalars(select(table.c.jti).where(table.c.jti.in_([row["jti"] for row in rows]))))
+            rows = [row for row in rows if row["jti"] not in known]
+            if rows:
+                db.session.execute(insert(table), rows)
+        # refused here right away, if the transaction rolls back the lookup finds nothing
+        with self._lock:
+            for token in tokens:
+                self.filter.add(token["jti"])
+
+    def prune(self):
+        """Deletes the rows of the tokens that expired anyway, returns how many"""
+        return db.session.execute(delete(RevokedToken).where(RevokedToken.expires <= utcnow())).rowcount
+
+
+revocations = RevocationList()
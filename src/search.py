@@ -0,0 +1,99 @@
+"""
+Filters, sorting and text search of GET /people and GET /planets, all of it done by the database:
+
+    ?gender=female&species=Human        equality on the columns listed in FILTERS
+    ?population_min=1000&gravity_max=1  ranges (and equality) on the numeric ones
+    ?height_min=180&sort=-weight        the measures too, "unknown" ones are NULL and never match
+    ?sort=name / ?sort=-population      one column of SORTS, "-" for descending, ties broken by id
+    ?q=skywalker hope                   words (or word prefixes) found in name or films
+
+Every filter has an index (models.py), the text search uses FTS5 on SQLite and a tsvector
+GIN index on Postgres.
+"""
+import re
+from flask import request
+from sqlalchemy import select, func, or_, and_, table, column
+from models import db, People, Planets, search_document
+from utils import APIException
+
+EXACT = "exact"
+RANGE = "range"
+
+FILTERS = {
+    People: {"gender": EXACT, "species": EXACT, "eye_color": EXACT, "hair_color": EXACT, "skin_color": EXACT,
+             "homeworld_id": EXACT, "birth_year": RANGE, "height": RANGE, "weight": RANGE},
+    Planets: {"climate": EXACT, "terrain": EXACT, "population": RANGE, "gravity": RANGE, "diameter": RANGE,
+              "rotation_period": RANGE, "orbital_period": RANGE, "surface_water": RANGE},
+}
+SORTS = {
+    People: {"id": People.id, "name": func.lower(People.name), "birth_year": People.birth_year, "height": People.height,
+             "weight": People.weight},
+    Planets: {"id": Planets.id, "name": func.lower(Planets.name), "population": Planets.population, "gravity": Planets.gravity,
+              "diameter": Planets.diameter, "rotation_period": Planets.rotation_period, "orbital_period": Planets.orbital_period,
+              "surface_water": Planets.surface_water},
+}
+
+
+def _value(attribute, field, raw):
+    kind = attribute.type.python_type
+    try:
+        return kind(raw)
+    except ValueError:
+        raise APIException(f"{field} must be a number", status_code=400)
+
+def filters(model):
+    conditions = []
+    for field, kind in FILTERS[model].items():
+        attribute = getattr(model, field)
+        comparisons = (("", attribute.__eq__),)
+        if kind == RANGE:
+            comparisons += (("_min", attribute.__ge__), ("_max", attribute.__le__))
+        for suffix, compare in comparisons:
+            if field + suffix in request.args:
+                conditions.append(compare(_value(attribute, field + suffix, request.args[field + suffix])))
+    return conditions
+
+def sort_order(model):
+    """(expression, descending) for keyset() in utils.py, None for the default id order"""
+    raw = request.args.get("sort")
+    if raw is None:
+        return None
+    descending = raw.startswith("-")
+    field = raw.lstrip("-")
+    if field not in SORTS[model]:
+        raise APIException(f"can't sort by {field}", status_code=400, payload={"available": list(SORTS[model])})
+    if field == "id" and not descending:
+        return None
+    return SORTS[model][field], descending
+
+
+def text_search(model, raw):
+    words = re.findall(r"\w+", raw)
+    if not words:
+        return None
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        name = f"{model.__tablename__}_fts"
+        fts = table(name, column("rowid"), column(name))
+        # every word quoted so nothing in it is read as FTS5 syntax, * matches it as a prefix
+        query = " ".join(f'"{word}"*' for word in words)
+        return model.id.in_(select(fts.c.rowid).where(fts.c[name].op("MATCH")(query)))
+    if dialect == "postgresql":
+        return search_document(model).op("@@")(func.to_tsquery("simple", " & ".join(f"{word}:*" for word in words)))
+    return and_(*(or_(model.name.ilike(f"%{word}%"), model.films.ilike(f"%{word}%")) for word in words))
+
+def search_conditions(model):
+    """The filters and the text search of the request, as WHERE conditions"""
+    conditions = filters(model)
+    if "q" in request.args:
+        match = text_search(model, request.args["q"])
+        if match is not None:
+            conditions.append(match)
+    return conditions
+
+def search(stmt, model):
+    """Applies the filters and the text search of the request to stmt, returns it with the sort order"""
+    conditions = search_conditions(model)
+    if conditions:
+        stmt = stmt.where(*conditions)
+    return stmt, sort_order(model)
@@ -0,0 +1,48 @@
+"""
+Aggregates of the numeric columns, computed by the database in one GROUP BY:
+
+    GET /planets/stats                          count, min, max and avg of every measure by climate
+    GET /people/stats?by=gender                 by another column of GROUPS
+    GET /people/stats?species=Human&q=hope      the filters and text search of GET /people (search.py)
+
+The unknown values are NULL, every measure has its own count of the rows that know it.
+"""
+from flask import request
+from sqlalchemy import select, func
+from models import db, People, Planets
+from search import search_conditions
+from utils import APIException
+
+# the first one is the default
+GROUPS = {
+    People: ("species", "gender", "homeworld_id"),
+    Planets: ("climate", "terrain"),
+}
+MEASURED = {
+    People: ("height", "weight", "birth_year"),
+    Planets: ("diameter", "rotation_period", "orbital_period", "surface_water", "population", "gravity"),
+}
+AGGREGATES = (("count", func.count), ("min", func.min), ("max", func.max), ("avg", func.avg))
+
+
+def stats(model):
+    by = request.args.get("by", GROUPS[model][0])
+    if by not in GROUPS[model]:
+        raise APIException(f"can't group by {by}", status_code=400, payload={"available": list(GROUPS[model])})
+    group = getattr(model, by)
+    columns = [aggregate(getattr(model, field)) for field in MEASURED[model] for _, aggregate in AGGREGATES]
+    stmt = select(group, func.count(), *columns).group_by(group).order_by(group)
+    conditions = search_conditions(model)
+    if conditions:
+        stmt = stmt.where(*conditions)
+    results = []
+    for row in db.session.execute(stmt):
+        result = {by: row[0], "count": row[1]}
+        values = iter(row[2:])
+        for field in MEASURED[model]:
+            result[field] = {name: next(values) for name, _ in AGGREGATES}
+            # Postgres averages as numeric
+            if result[field]["avg"] is not None:
+                result[field]["avg"] = float(result[field]["avg"])
+        results.append(result)
+    return results
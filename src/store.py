@@ -0,0 +1,118 @@
+"""
+Shared key-value store used by the features that need state across gunicorn workers (response cache, ...).
+redis://... urls use a real Redis server, memory:// a local stand-in with the same interface
+that works inside a single process (development, tests, one worker deployments).
+"""
+import threading
+import time
+
+
+class MemoryStore:
+    """The subset of the redis-py client the app uses, kept in a dict"""
+
+    # Lua source -> the same script in Python, fn(store, keys, args). Lua can't run here, the modules
+    # that use a script register their version of it so the code calling it is the same as with redis
+    scripts = {}
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        # reentrant: the scripts hold it while they call the other commands, like redis runs them
+        self._lock = threading.RLock()
+
+    def _alive(self, name):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        with self._lock:
+            return self._data.get(name) if self._alive(name) else None
+
+    def mget(self, names):
+        with self._lock:
+            return [self._data.get(name) if self._alive(name) else None for name in names]
+
+    def set(self, name, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._data[name] = value
+            if ex is None:
+                self._expires.pop(name, None)
+            else:
+                self._expires[name] = time.monotonic() + ex
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            deleted = 0
+            for name in names:
+                if self._alive(name):
+                    deleted += 1
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return deleted
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self._data[name]) + amount if self._alive(name) else amount
+            self._data[name] = str(value).encode()
+            return value
+
+    def hmget(self, name, keys):
+        with self._lock:
+            values = self._data.get(name) if self._alive(name) else None
+            return [values.get(key) if values is not None else None for key in keys]
+
+    def hset(self, name, mapping):
+        with self._lock:
+            values = self._data.get(name) if self._alive(name) else None
+            if values is None:
+                values = self._data[name] = {}
+            values.update({key: str(value).encode() for key, value in mapping.items()})
+            return len(mapping)
+
+    def expire(self, name, seconds):
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expires[name] = time.monotonic() + seconds
+            return True
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self._lock:
+            # _alive() drops the expired names from _data
+            names = [name for name in list(self._data) if name.startswith(prefix) and self._alive(name)]
+        return iter(names)
+
+    def time(self):
+        now = time.time()
+        return int(now), int(now % 1 * 1000000)
+
+    def register_script(self, script):
+        function = self.scripts[script]
+
+        def run(keys=(), args=(), client=None):
+            with self._lock:
+                return function(self, list(keys), list(args))
+        return run
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+        return True
+
+
+def connect(url):
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        # optional dependency, only needed when a real redis server is configured
+        import redis
+        return redis.Redis.from_url(url)
+    raise ValueError(f"unsupported store url {url}")
@@ -1,4 +1,20 @@
-from flask import jsonify, url_for
+import os
+from flask import jsonify, url_for, request, json, Response, stream_with_context, current_app, g
+from flask.json.provider import DefaultJSONProvider
+from functools import wraps
+from sqlalchemy import select, or_, and_
+from models import db, table_versions
+
+try:
+    import orjson
+except ImportError:
+    # optional, `pipenv install orjson` to use it, the stdlib encoder is used without it
+    orjson = None
+
+# keyset pagination: ?limit=<n>&after=<last id seen>
+MAX_PAGE_SIZE = 100
+# rows fetched per round trip when streaming a whole table
+STREAM_BATCH_SIZE = 500
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +31,171 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def pagination_args():
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        after = int(request.args["after"]) if "after" in request.args else None
+    except ValueError:
+        raise APIException("limit and after must be integers", status_code=400)
+    if limit is not None and limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+    return limit, after
+
+def requested_fields(available, parameter="fields"):
+    """?fields=id,name,image -> {"id", "name", "image"}, None when the parameter isn't there"""
+    raw = request.args.get(parameter)
+    if raw is None:
+        return None
+    fields = {field.strip() for field in raw.split(",") if field.strip()}
+    unknown = fields - set(available)
+    if unknown:
+        raise APIException(f"unknown {parameter}: {', '.join(sorted(unknown))}", status_code=400, payload={"available": list(available)})
+    return fields
+
+def keyset(stmt, model, order=None):
+    """
+    order is an optional (expression, descending) to sort by before the id, its NULLs go last.
+    The cursor stays the id of the last row seen, its sort value is looked up to resume after it.
+    """
+    limit, after = pagination_args()
+    if order is None:
+        stmt = stmt.order_by(model.id)
+        if after is not None:
+            stmt = stmt.where(model.id > after)
+        return stmt, limit
+    expression, descending = order
+    stmt = stmt.order_by((expression.desc() if descending else expression.asc()).nulls_last(), model.id)
+    if after is not None:
+        row = db.session.execute(select(expression).where(model.id == after)).first()
+        if row is None:
+            raise APIException("after must be the id of a row of the list", status_code=400)
+        value, = row
+        if value is None:
+            stmt = stmt.where(expression.is_(None), model.id > after)
+        else:
+            beyond = expression < value if descending else expression > value
+            stmt = stmt.where(or_(beyond, and_(expression == value, model.id > after), expression.is_(None)))
+    return stmt, limit
+
+def fetch(stmt):
+    # select(Model) gives one instance per row, column projections (see models.py) give the rows themselves
+    result = db.session.execute(stmt)
+    descriptions = stmt.column_descriptions
+    return result.scalars() if len(descriptions) == 1 and isinstance(descriptions[0]["type"], type) else result
+
+def paginate(stmt, model, serialize, order=None):
+    """
+    serialize turns a list of instances/rows into a list of dicts.
+    Returns the serialized page and the cursor to ask for the next one (None on the last page)
+    """
+    stmt, limit = keyset(stmt, model, order)
+    if limit is None:
+        return serialize(fetch(stmt).all()), None
+    items = fetch(stmt.limit(limit + 1)).all()
+    next_cursor = items[limit - 1].id if len(items) > limit else None
+    return serialize(items[:limit]), next_cursor
+
+def wants_stream():
+    return request.args.get("stream") is not None
+
+def stream_results(stmt, model, serialize, key="results", order=None):
+    """
+    Streams the rows as they come out of the database instead of building the whole list in memory.
+    ?stream=ndjson sends one object per line, ?stream=json sends a regular {"results": [...]} body in chunks.
+    """
+    mode = request.args.get("stream")
+    if mode not in ("ndjson", "json"):
+        raise APIException("stream must be ndjson or json", status_code=400)
+    stmt, limit = keyset(stmt, model, order)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    stmt = stmt.execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    def serialized():
+        for partition in fetch(stmt).partitions():
+            yield from serialize(partition)
+
+    def generate_ndjson():
+        for item in serialized():
+            yield json.dumps(item) + "\n"
+
+    def generate_json():
+        yield '{"%s":[' % key
+        separator = ""
+        for item in serialized():
+            yield separator + json.dumps(item)
+            separator = ","
+        yield "]}"
+
+    if mode == "ndjson":
+        return Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson")
+    return Response(stream_with_context(generate_json()), mimetype="application/json")
+
+def request_table_versions(tables):
+    """table_versions() read once per request, conditional() and cached() share them"""
+    known = g.setdefault("table_versions", {})
+    missing = [name for name in tables if name not in known]
+    if missing:
+        known.update(zip(missing, table_versions(missing)))
+    return [known[name] for name in tables]
+
+def conditional(*tables, vary=None):
+    """
+    Strong ETag built from the versions of the tables the response is made of (plus vary(), for
+    responses that depend on who asks). A matching If-None-Match gets a 304 before the view runs.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = ".".join(str(version) for version in request_table_versions(tables))
+            if vary is not None:
+                tag = f"{vary()}-{tag}"
+            # the compressed variants carry the encoding after a "+" (see compression.py)
+            matched = next((etag for etag in request.if_none_match if etag == tag or etag.startswith(tag + "+")), None)
+            if matched is not None:
+                response = Response(status=304)
+                response.set_etag(matched)
+                return response
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(f"{tag}+{response.content_encoding}" if response.content_encoding else tag)
+            return response
+        return wrapper
+    return decorator
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, encodes straight to bytes"""
+
+    def _options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options(kwargs.get("indent"))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def setup_json(app):
+    """JSON_BACKEND=orjson|stdlib, orjson by default when it is installed"""
+    backend = os.getenv("JSON_BACKEND", "orjson" if orjson is not None else "stdlib")
+    if backend == "orjson":
+        if orjson is None:
+            raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+        app.json = OrjsonProvider(app)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -1,5 +1,6 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
+# The worker settings (gthread by default, gevent or sync) live in gunicorn.conf.py at the root.
 
 from app import app as application
 
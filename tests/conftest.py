@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+# the tests sign up and log in more often than ratelimit.py allows a client, test_ratelimit.py sets its own limits
+for limit in ("RATELIMIT_LOGIN_IP", "RATELIMIT_LOGIN_EMAIL", "RATELIMIT_SIGNUP_IP"):
+    os.environ.setdefault(limit, "1000000/1")
+# the tests revoke in this process, known at once, the periodic sync of revocation.py would add a query to random requests
+os.environ.setdefault("REVOCATION_SYNC_SECONDS", "3600")
+# and an expiring entry of the user cache of auth.py would add a lookup to some of them too
+os.environ.setdefault("AUTH_USER_CACHE_TTL", "3600")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import event
+from app import app as flask_app
+from auth import users
+from cache import cache
+from models import db
+from ratelimit import limiter
+from revocation import revocations
+
+PASSWORD = "test password"
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    # every test starts from empty tables, the versions (and cache keys) start again from 0 too
+    cache.backend.clear()
+    users.clear()
+    limiter.backend.clear()
+    revocations.configure(revocations.capacity, revocations.sync_seconds)
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def tokens(client):
+    """The access and refresh token of a new user"""
+    client.post("/signup", json={"email": "user@tests.test", "password": PASSWORD})
+    return client.post("/login", json={"email": "user@tests.test", "password": PASSWORD}).get_json()
+
+
+@pytest.fixture
+def token(tokens):
+    return tokens["access_token"]
+
+
+@contextmanager
+def count_queries():
+    """Collects every SQL statement sent while the block runs, needs an app context"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def assert_num_queries(app):
+    """with assert_num_queries(2): ..., fails when the block sends another number of statements"""
+    @contextmanager
+    def check(expected):
+        with app.app_context(), count_queries() as statements:
+            yield statements
+        if len(statements) != expected:
+            raise AssertionError(f"expected {expected} queries, got {len(statements)}:\n" + "\n".join(statements))
+    return check
@@ -0,0 +1,76 @@
+"""
+Token refresh and revocation: /logout revokes its access token and the refresh token of its body,
+and the revoked tokens stay refused once the filter of revocation.py is rebuilt from the table.
+Only hashed passwords log in, the admin hashes the ones it saves.
+"""
+from admin import UserView
+from conftest import PASSWORD
+from models import db, User
+from passwords import is_hashed
+from revocation import revocations
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_refresh(client, tokens):
+    response = client.post("/refresh", headers=bearer(tokens["refresh_token"]))
+    assert response.status_code == 200
+    assert client.get("/user/favorites", headers=bearer(response.get_json()["access_token"])).status_code == 200
+    # an access token doesn't refresh, a refresh token doesn't authenticate
+    assert client.post("/refresh", headers=bearer(tokens["access_token"])).status_code == 422
+    assert client.get("/user/favorites", headers=bearer(tokens["refresh_token"])).status_code == 422
+
+
+def test_logout_revokes(client, tokens):
+    headers = bearer(tokens["access_token"])
+    response = client.post("/logout", json={"refresh_token": tokens["refresh_token"]}, headers=headers)
+    assert response.status_code == 200
+    response = client.get("/user/favorites", headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()["msg"] == "Token has been revoked"
+    assert client.post("/refresh", headers=bearer(tokens["refresh_token"])).status_code == 401
+    # the tokens of another login still work
+    other = client.post("/login", json={"email": "user@tests.test", "password": PASSWORD}).get_json()
+    assert client.get("/user/favorites", headers=bearer(other["access_token"])).status_code == 200
+
+
+def test_revoked_after_rebuild(client, tokens):
+    client.post("/logout", headers=bearer(tokens["access_token"]))
+    # what a worker that didn't revoke it knows: the rows of the table
+    revocations.configure(revocations.capacity, revocations.sync_seconds)
+    assert client.get("/user/favorites", headers=bearer(tokens["access_token"])).status_code == 401
+    assert client.post("/refresh", headers=bearer(tokens["refresh_token"])).status_code == 200
+
+
+def test_logout_foreign_refresh_token(client, tokens):
+    client.post("/signup", json={"email": "other@tests.test", "password": PASSWORD})
+    other = client.post("/login", json={"email": "other@tests.test", "password": PASSWORD}).get_json()
+    response = client.post("/logout", json={"refresh_token": other["refresh_token"]}, headers=bearer(tokens["access_token"]))
+    assert response.status_code == 400
+    # nothing was revoked
+    assert client.get("/user/favorites", headers=bearer(tokens["access_token"])).status_code == 200
+    assert client.post("/refresh", headers=bearer(other["refresh_token"])).status_code == 200
+
+
+def test_plain_password_refused(app, client):
+    with app.app_context():
+        db.session.add(User(email="plain@tests.test", password=PASSWORD))
+        db.session.commit()
+    assert client.post("/login", json={"email": "plain@tests.test", "password": PASSWORD}).status_code == 401
+
+
+def test_admin_hashes_password(app, client):
+    view = UserView(User, db.session)
+    with app.app_context():
+        user = User(email="admin@tests.test", password=PASSWORD)
+        view.on_model_change(None, user, True)
+        db.session.add(user)
+        db.session.commit()
+        stored = user.password
+        assert is_hashed(stored)
+        # saving the user again keeps the hash
+        view.on_model_change(None, user, False)
+        assert user.password == stored
+    assert client.post("/login", json={"email": "admin@tests.test", "password": PASSWORD}).status_code == 200
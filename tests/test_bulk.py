@@ -0,0 +1,69 @@
+"""
+POST /people/bulk and /planets/bulk: the good records are saved, every bad one is reported in the
+summary by its index (and its line for NDJSON) without failing the others.
+"""
+
+
+def test_people_summary(client):
+    client.post("/planets", json={"name": "Tatooine"})
+    client.post("/people", json={"name": "Luke Skywalker"})
+    response = client.post("/people/bulk", json=[
+        {"name": "Leia Organa", "homeworld_id": 1, "height": "150"},
+        {"height": 172},
+        {"name": "LUKE SKYWALKER"},
+        {"name": "Han Solo", "homeworld_id": "1"},
+        {"name": "leia organa"},
+        {"name": "Obi-Wan Kenobi", "homeworld_id": 99},
+        "Yoda",
+        {"name": "Chewbacca", "height": "very tall"},
+    ])
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary["inserted"] == 1
+    assert summary["skipped"] == [
+        {"index": 4, "name": "leia organa", "reason": "duplicated in the import"},
+        {"index": 2, "name": "LUKE SKYWALKER", "reason": "already exists"},
+    ]
+    assert {error["index"]: error["error"] for error in summary["errors"]} == {
+        1: "name field is obligatory",
+        3: "homeworld_id must be an integer",
+        5: "planet 99 not found",
+        6: "record must be an object",
+        7: "height must be a number",
+    }
+    person = client.get("/people/2").get_json()["result"]
+    assert (person["name"], person["height"], person["homeworld"]["id"]) == ("Leia Organa", 150, 1)
+
+
+def test_ndjson_invalid_lines(client):
+    body = '{"name": "Hoth"}\n{"name": "Dagobah",\n\n{"name": "Endor"}\n[1, 2]\n'
+    response = client.post("/planets/bulk", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary["inserted"] == 2
+    # the blank line has no record, the indexes skip it while the lines count it
+    assert [(error["index"], error.get("line")) for error in summary["errors"]] == [(1, 2), (3, None)]
+    assert summary["errors"][0]["error"].startswith("invalid JSON")
+    assert [planet["name"] for planet in client.get("/planets").get_json()["results"]] == ["Hoth", "Endor"]
+
+
+def test_planet_residents(client):
+    client.post("/people/bulk", json=[{"name": "Luke Skywalker"}, {"name": "Owen Lars"}])
+    response = client.post("/planets/bulk", json=[
+        {"name": "Tatooine", "residents_id": [1, 2]},
+        {"name": "Alderaan", "residents_id": [3]},
+        {"name": "Bespin", "residents_id": "1"},
+    ])
+    summary = response.get_json()
+    assert summary["inserted"] == 1
+    assert {error["index"]: error["error"] for error in summary["errors"]} == {
+        1: "people [3] not found",
+        2: "residents_id must be a list of integers",
+    }
+    assert client.get("/people/2").get_json()["result"]["homeworld"]["id"] == 1
+
+
+def test_not_a_list(client):
+    response = client.post("/people/bulk", json={"name": "Luke Skywalker"})
+    assert response.status_code == 400
+    assert "JSON list" in response.get_json()["message"]
@@ -0,0 +1,69 @@
+"""
+ETags, 304s, the response cache and compression: a write anywhere changes the ETag and the cache
+key of every response made of its table, the compressed variants carry their own ETag.
+"""
+import gzip
+
+from conftest import PASSWORD
+from models import db, People
+
+
+def test_not_modified(client):
+    client.post("/people", json={"name": "Luke Skywalker"})
+    response = client.get("/people")
+    etag = response.headers["ETag"]
+    response = client.get("/people", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == etag
+    # a write changes the ETag, the old one gets the new body
+    client.post("/people", json={"name": "Leia Organa"})
+    response = client.get("/people", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [person["name"] for person in response.get_json()["results"]] == ["Luke Skywalker", "Leia Organa"]
+
+
+def test_write_outside_the_endpoints(app, client):
+    client.post("/planets", json={"name": "Tatooine"})
+    client.post("/people", json={"name": "Luke Skywalker", "homeworld_id": 1})
+    before = client.get("/people/1")
+    assert client.get("/people/1").headers["X-Cache"] == "HIT"
+    # like the admin does
+    with app.app_context():
+        db.session.get(People, 1).name = "Luke"
+        db.session.commit()
+    response = client.get("/people/1", headers={"If-None-Match": before.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.get_json()["result"]["name"] == "Luke"
+
+
+def test_favourites_etag_per_user(client, token):
+    client.post("/planets", json={"name": "Tatooine"})
+    client.post("/favorite/planet/1", headers={"Authorization": f"Bearer {token}"})
+    etag = client.get("/user/favorites", headers={"Authorization": f"Bearer {token}"}).headers["ETag"]
+    client.post("/signup", json={"email": "other@tests.test", "password": PASSWORD})
+    other = client.post("/login", json={"email": "other@tests.test", "password": PASSWORD}).get_json()["access_token"]
+    response = client.get("/user/favorites", headers={"Authorization": f"Bearer {other}", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["results"] == []
+
+
+def test_compressed(client):
+    client.post("/people/bulk", json=[{"name": f"person {i}", "films": "A New Hope"} for i in range(50)])
+    plain = client.get("/people?limit=100")
+    assert "Content-Encoding" not in plain.headers
+    # the first one compresses the cached body, the second one finds the variant
+    for _ in range(2):
+        response = client.get("/people?limit=100", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["X-Cache"] == "HIT"
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.get_data()) == plain.get_data()
+        assert response.headers["ETag"] == plain.headers["ETag"].rstrip('"') + '+gzip"'
+    response = client.get("/people?limit=100", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    # small bodies go out as they are
+    response = client.get("/people?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,63 @@
+"""
+Queries per request of the list endpoints, pinned with the assert_num_queries fixture. Every count is
+checked with one row and again with more rows, a query per row would show up as a different count.
+"""
+import pytest
+
+from conftest import PASSWORD
+
+
+def add_rows(client, token, start, count):
+    """count planets and people (with a homeworld, films and starships), each a favourite of the user"""
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(start, start + count):
+        planet = client.post("/planets", json={"name": f"planet {i}", "climate": "arid", "films": "A New Hope"})
+        person = client.post("/people", json={"name": f"person {i}", "homeworld_id": planet.get_json()["results"]["id"],
+                                              "films": "A New Hope, Return of the Jedi", "starships": "X-wing"})
+        client.post(f"/favorite/planet/{planet.get_json()['results']['id']}", headers=headers)
+        client.post(f"/favorite/people/{person.get_json()['results']['id']}", headers=headers)
+        client.post("/signup", json={"email": f"user{i}@queries.test", "password": PASSWORD})
+
+
+@pytest.fixture
+def get(client, assert_num_queries):
+    def get(path, expected, **kwargs):
+        with assert_num_queries(expected):
+            response = client.get(path, **kwargs)
+        assert response.status_code in (200, 304)
+        return response
+    return get
+
+
+@pytest.mark.parametrize("rows", [1, 10])
+def test_users(client, token, get, rows):
+    add_rows(client, token, 0, rows)
+    response = get("/users?limit=50", 3)
+    assert len(response.get_json()["result"]) == rows + 1
+
+
+@pytest.mark.parametrize("path, rows", [("/people?limit=100", 1), ("/people?limit=100", 10),
+                                        ("/planets?limit=100", 1), ("/planets?limit=100", 10)])
+def test_catalogue(client, token, get, path, rows):
+    add_rows(client, token, 0, rows)
+    # versions and the page (planets also read their residents), the cache then answers with the versions read alone
+    response = get(path, 3 if path.startswith("/planets") else 2)
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(response.get_json()["results"]) == rows
+    assert get(path, 1).headers["X-Cache"] == "HIT"
+    assert get(path, 1, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+@pytest.mark.parametrize("rows", [1, 10])
+def test_user_favourites(client, token, get, rows):
+    headers = {"Authorization": f"Bearer {token}"}
+    add_rows(client, token, 0, rows)
+    # the first read builds the snapshot from the favourites, the next ones read it back
+    response = get("/user/favorites", 4, headers=headers)
+    assert len(response.get_json()["results"]) == 2 * rows
+    get("/user/favorites", 2, headers=headers)
+    # the writes keep the snapshot up to date
+    add_rows(client, token, rows, rows)
+    response = get("/user/favorites", 2, headers=headers)
+    assert len(response.get_json()["results"]) == 4 * rows
+    get("/user/favorites", 1, headers={**headers, "If-None-Match": response.headers["ETag"]})
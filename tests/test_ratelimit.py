@@ -0,0 +1,71 @@
+"""
+429 and Retry-After of the credential endpoints (ratelimit.py), on the local buckets and on
+memory://, the stand-in for redis://.
+"""
+import time
+
+import pytest
+
+import store
+from conftest import PASSWORD
+from ratelimit import limiter, SharedBuckets
+
+
+@pytest.fixture(params=["local", "memory://"])
+def limits(request, client, monkeypatch):
+    """limits(login_email=(2, 60.0)) sets the limits of the test, which runs on each backend"""
+    limiter.configure(url=request.param)
+
+    def set_limits(**limits):
+        for name, limit in limits.items():
+            monkeypatch.setitem(limiter.limits, name.replace("_", ":"), limit)
+    yield set_limits
+    limiter.configure()
+
+
+def login(client, email, password=PASSWORD):
+    return client.post("/login", json={"email": email, "password": password})
+
+
+def test_email_limit(client, tokens, limits, assert_num_queries):
+    limits(login_email=(2, 60.0))
+    assert login(client, "user@tests.test").status_code == 200
+    # the wrong password and the changed case count for the same account
+    assert login(client, "USER@tests.test ", "wrong").status_code == 401
+    # refused before the view: no user lookup, no password hashing
+    with assert_num_queries(0):
+        response = login(client, "user@tests.test")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 30
+    assert "try again" in response.get_json()["msg"]
+    # the other accounts have their own bucket
+    assert login(client, "other@tests.test").status_code == 404
+
+
+def test_ip_limit(client, limits):
+    limits(login_ip=(2, 60.0))
+    assert [login(client, f"user{i}@tests.test").status_code for i in range(3)] == [404, 404, 429]
+    assert client.post("/login", json={}, environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code != 429
+
+
+def test_refill(client, tokens, limits):
+    # one attempt every half second, longer than a login takes
+    limits(login_email=(1, 0.5))
+    assert login(client, "user@tests.test").status_code == 200
+    response = login(client, "user@tests.test")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    time.sleep(0.5)
+    assert login(client, "user@tests.test").status_code == 200
+
+
+def test_memory_store_clear_after_expiry():
+    client = store.MemoryStore()
+    buckets = SharedBuckets(client)
+    buckets.take("login:ip:1", 5, 1.0)
+    buckets.take("login:ip:2", 5, 1.0)
+    client.expire("ratelimit:login:ip:1", 0.001)
+    time.sleep(0.01)
+    assert list(client.scan_iter("ratelimit:*")) == ["ratelimit:login:ip:2"]
+    buckets.clear()
+    assert list(client.scan_iter("*")) == []
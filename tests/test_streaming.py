@@ -0,0 +1,18 @@
+"""
+?stream=json and ?stream=ndjson: the rows of the whole table, byte for byte the serialization of
+the paginated responses.
+"""
+import json
+
+
+def test_same_bytes(client):
+    client.post("/people/bulk", json=[{"name": f"person {i}", "films": "A New Hope", "height": 170 + i} for i in range(5)])
+    page = client.get("/people").get_data()
+    # the keys are sorted, "next" comes before "results"
+    prefix = b'{"next":null,"results":'
+    assert page.startswith(prefix)
+    results = page[len(prefix):page.rindex(b"}")]
+    assert client.get("/people?stream=json").get_data() == b'{"results":' + results + b"}"
+    lines = client.get("/people?stream=ndjson").get_data().splitlines()
+    assert b"[" + b",".join(lines) + b"]" == results
+    assert [json.loads(line)["name"] for line in lines] == [f"person {i}" for i in range(5)]